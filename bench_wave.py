@@ -0,0 +1,177 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import gen_wave
+import wave
+
+
+# scale name: approximate order lines
+SCALES = {
+    '10k': 10000,
+    '100k': 100000,
+    '1m': 1000000,
+    '10m': 10000000,
+}
+
+STAGES = ['load_boh', 'load_orders', 'check_orders', 'report']
+
+
+# returns: (wave_set, boh) paths of the synthetic inputs for a scale, generated once per seed
+def make_inputs(work_dir, scale, lines, seed):
+    wave_set = os.path.join(work_dir, f'wave_set_{scale}_{seed}.csv')
+    boh = os.path.join(work_dir, f'boh_{scale}_{seed}.csv')
+    if not (os.path.exists(wave_set) and os.path.exists(boh)):
+        rng = random.Random(seed)
+        skus = max(100, lines // 25)
+        orders = max(1, round(lines / 1.5))
+        demand = gen_wave.generate_orders(wave_set, rng, orders, skus, 1.5, 20, 1.0, 5, True)
+        gen_wave.generate_boh(boh, rng, demand, [0.95, 0.9, 0.85, 0.95], 0.01, 1.0)
+    return wave_set, boh
+
+
+def count_lines(fname):
+    with open(fname, 'rb') as f:
+        return sum(1 for _ in f) - 1
+
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, dirs, names in os.walk(path) for name in names)
+
+
+def peak_rss_kb():
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+# runs in a fresh process so peak RSS covers only this stage (and its inputs)
+def run_stage(stage, wave_set, boh, work_dir):
+    result = {}
+    if stage == 'load_boh':
+        start, cpu = time.perf_counter(), time.process_time()
+        bohs = wave.load_boh(boh)
+        wall, cpu = time.perf_counter() - start, time.process_time() - cpu
+        result['rows_per_s'] = count_lines(boh) / wall
+
+    elif stage == 'load_orders':
+        start, cpu = time.perf_counter(), time.process_time()
+        orders = wave.load_orders(wave_set)
+        wall, cpu = time.perf_counter() - start, time.process_time() - cpu
+        result['lines_per_s'] = count_lines(wave_set) / wall
+        result['orders_per_s'] = len(orders) / wall
+
+    else:
+        bohs = wave.load_boh(boh)
+        orders = wave.load_orders(wave_set)
+        if stage == 'check_orders':
+            start, cpu = time.perf_counter(), time.process_time()
+            order_stats = [wave.check_orders(orders, boh) for boh in bohs]
+            wall, cpu = time.perf_counter() - start, time.process_time() - cpu
+            result['lines_per_s'] = count_lines(wave_set) * len(bohs) / wall
+            result['orders_per_s'] = len(orders) * len(bohs) / wall
+
+        else:
+            order_stats = [wave.check_orders(orders, boh) for boh in bohs]
+            report_dir = tempfile.mkdtemp(prefix='report_', dir=work_dir)
+            os.rmdir(report_dir)
+            try:
+                start, cpu = time.perf_counter(), time.process_time()
+                wave.write_reports(report_dir, order_stats, bohs)
+                wall, cpu = time.perf_counter() - start, time.process_time() - cpu
+                written = dir_size(report_dir)
+
+            finally:
+                shutil.rmtree(report_dir, ignore_errors=True)
+            result['bytes_written'] = written
+            result['bytes_per_s'] = written / wall
+
+    result['wall_s'] = wall
+    result['cpu_s'] = cpu
+    result['peak_rss_kb'] = peak_rss_kb()
+    return result
+
+
+# returns: {"scale/stage": result}
+def run(scales, stages, work_dir, seed):
+    ctx = multiprocessing.get_context('spawn')
+    results = {}
+    for scale in scales:
+        wave_set, boh = make_inputs(work_dir, scale, SCALES.get(scale) or int(scale), seed)
+        for stage in stages:
+            with ctx.Pool(1) as pool:
+                result = pool.apply(run_stage, (stage, wave_set, boh, work_dir))
+            results[f'{scale}/{stage}'] = result
+            print(f'{scale: <8}{stage: <14}{result["wall_s"]: >10.3f}s{result["peak_rss_kb"] / 1024: >10.1f}MB')
+
+    return results
+
+
+# returns: list of regression messages (wall time or peak rss past the thresholds)
+def compare(results, baseline, time_threshold, rss_threshold):
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+
+        if result['wall_s'] > base['wall_s'] * (1 + time_threshold):
+            regressions.append(f'{key}: wall {base["wall_s"]:.3f}s -> {result["wall_s"]:.3f}s')
+        if result['peak_rss_kb'] > base['peak_rss_kb'] * (1 + rss_threshold):
+            regressions.append(f'{key}: peak rss {base["peak_rss_kb"]}KB -> {result["peak_rss_kb"]}KB')
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark wave.py stages on synthetic inputs')
+    parser.add_argument('-s', '--scales', type=str, default='10k,100k', help=f'comma-separated scales ({",".join(SCALES)}, or a line count)')
+    parser.add_argument('--stages', type=str, default=','.join(STAGES), help='comma-separated stages')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the synthetic inputs')
+    parser.add_argument('-w', '--work-dir', type=str, default='bench_data', help='where synthetic inputs are kept')
+    parser.add_argument('-o', '--output', type=str, help='save results as JSON')
+    parser.add_argument('-b', '--baseline', type=str, help='compare against JSON results saved earlier')
+    parser.add_argument('--time-threshold', type=float, default=0.2, help='allowed wall time increase (fraction)')
+    parser.add_argument('--rss-threshold', type=float, default=0.2, help='allowed peak RSS increase (fraction)')
+
+    args = parser.parse_args()
+
+    stages = args.stages.split(',')
+    for stage in stages:
+        if stage not in STAGES:
+            parser.error(f'unknown stage: {stage}')
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    results = run(args.scales.split(','), stages, args.work_dir, args.seed)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'seed': args.seed,
+                'results': results,
+            }, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+        regressions = compare(results, baseline, args.time_threshold, args.rss_threshold)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
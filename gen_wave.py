@@ -0,0 +1,118 @@
+import argparse
+import bisect
+import csv
+import itertools
+import math
+import random
+
+
+BOH_HEADERS = ['PRTNUM', 'Available Qty 1', 'Available Qty 3', 'Available Qty 4', 'Available Qty 6', 'LEVEL 1 LOCATION', 'LEVEL 3 LOCATION', 'LEVEL 4 LOCATION', 'LEVEL 6 LOCATION']
+ORDER_HEADERS = ['SHIP_ID', 'PRTNUM', 'WAVE_SET', 'ORDQTY']
+
+
+# returns: cumulative zipf weights for skus ranked 0..count-1
+def zipf_weights(count, exponent):
+    return list(itertools.accumulate(1 / (rank + 1) ** exponent for rank in range(count)))
+
+
+# returns: a multiplier a (coprime with count) so that (a * i + b) % count
+# permutes 0..count-1 without keeping the permutation in memory
+def coprime_multiplier(count, rng):
+    while True:
+        a = rng.randrange(1, max(count, 2))
+        if math.gcd(a, count) == 1:
+            return a
+
+
+# writes wave_set.csv; returns: list of demanded qty per sku rank
+def generate_orders(fname, rng, orders, skus, lines_per_order, max_lines, zipf, max_qty, shuffle):
+    cum_weights = zipf_weights(skus, zipf)
+    total = cum_weights[-1]
+    more_lines = 1 - 1 / lines_per_order  # chance of another line (geometric)
+    demand = [0] * skus
+
+    width = len(str(orders))
+    a = coprime_multiplier(orders, rng) if shuffle else 1
+    b = rng.randrange(orders) if shuffle else 0
+
+    with open(fname, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(ORDER_HEADERS)
+
+        for i in range(orders):
+            ship_id = f'S{(a * i + b) % orders:0{width}d}'
+
+            count = 1
+            while count < max_lines and rng.random() < more_lines:
+                count += 1
+
+            picked = set()
+            rows = []
+            for _ in range(count * 2):
+                if len(picked) == count:
+                    break
+                rank = bisect.bisect_left(cum_weights, rng.random() * total)
+                rank = min(rank, skus - 1)
+                if rank in picked:
+                    continue
+
+                picked.add(rank)
+                qty = min(max_qty, 1 + int(rng.expovariate(1.0)))
+                demand[rank] += qty
+                rows.append([ship_id, f'P{rank:0{len(str(skus))}d}', 'ECOM', qty])
+
+            writer.writerows(rows)
+
+    return demand
+
+
+# writes boh.csv for the skus in demand (by rank)
+def generate_boh(fname, rng, demand, coverage, missing, stock):
+    with open(fname, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(BOH_HEADERS)
+
+        width = len(str(len(demand)))
+        for rank, qty in enumerate(demand):
+            if rng.random() < missing:
+                continue
+
+            qtys = [int(qty * stock * rng.uniform(0.5, 1.5)) for _ in coverage]
+            locations = ['X' if rng.random() < c else '' for c in coverage]
+            writer.writerow([f'P{rank:0{width}d}'] + qtys + locations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='generate a synthetic wave_set and boh for wave.py')
+    parser.add_argument('wave_set')
+    parser.add_argument('boh')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='random seed (same seed, same files)')
+    parser.add_argument('-n', '--orders', type=int, default=1000, help='number of orders')
+    parser.add_argument('-l', '--lines', type=int, help='approximate total order lines (overrides --orders)')
+    parser.add_argument('--skus', type=int, default=1000, help='number of distinct SKUs')
+    parser.add_argument('--lines-per-order', type=float, default=1.5, help='mean lines per order (geometric)')
+    parser.add_argument('--max-lines', type=int, default=20, help='max lines per order')
+    parser.add_argument('--max-qty', type=int, default=5, help='max qty per order line')
+    parser.add_argument('--zipf', type=float, default=1.0, help='zipf exponent of SKU popularity')
+    parser.add_argument('--coverage', type=str, default='0.9,0.7,0.5,0.9', help='fraction of BOH SKUs slotted at levels 1,3,4,6')
+    parser.add_argument('--missing', type=float, default=0.05, help='fraction of SKUs left out of the BOH')
+    parser.add_argument('--stock', type=float, default=1.0, help='BOH qty as a multiple of total demand per SKU')
+    parser.add_argument('--shuffle', action='store_true', help='write orders out of SHIP_ID order')
+
+    args = parser.parse_args()
+
+    coverage = [float(x) for x in args.coverage.split(',')]
+    if len(coverage) != 4:
+        parser.error('--coverage takes 4 comma-separated fractions')
+
+    orders = args.orders
+    if args.lines:
+        orders = max(1, math.ceil(args.lines / args.lines_per_order))
+
+    rng = random.Random(args.seed)
+    demand = generate_orders(args.wave_set, rng, orders, args.skus, args.lines_per_order, args.max_lines, args.zipf, args.max_qty, args.shuffle)
+    generate_boh(args.boh, rng, demand, coverage, args.missing, args.stock)
+
+
+if __name__ == "__main__":
+    main()
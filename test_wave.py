@@ -0,0 +1,470 @@
+import csv
+import heapq
+import io
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import gen_wave
+import wave
+
+
+# returns: (wave_set, boh) paths of synthetic inputs written to work_dir
+def make_inputs(work_dir, seed, orders=1000, skus=200, lines_per_order=1.5):
+    wave_set = os.path.join(work_dir, f'wave_set_{seed}.csv')
+    boh = os.path.join(work_dir, f'boh_{seed}.csv')
+    rng = random.Random(seed)
+    demand = gen_wave.generate_orders(wave_set, rng, orders, skus, lines_per_order, 20, 1.0, 5, True)
+    gen_wave.generate_boh(boh, rng, demand, [0.9, 0.7, 0.5, 0.9], 0.05, 0.8)
+    return wave_set, boh
+
+
+# returns: check_orders results for one level in plain, comparable form
+def plain(stats, boh):
+    ready_orders, replen_orders, slot_results = stats
+    return {
+        'ready': [order.ship_id for order in ready_orders],
+        'replen': [order.ship_id for order in replen_orders],
+        'slots': [(list(skus), [order.ship_id for order in addn_orders], dict(trial_boh)) for skus, addn_orders, trial_boh in slot_results],
+        'boh': dict(boh),
+    }
+
+
+# returns: check_orders results, the way check_orders first worked them out:
+# every slot step re-simulates the slot orders on a fresh copy of boh
+def reference_check_orders(orders, boh):
+    ready_orders = []
+    retry_orders = []
+    for order in orders:
+        (ready_orders if order.commit(boh, False) else retry_orders).append(order)
+
+    replen_orders = []
+    slot_orders = []
+    for order in retry_orders:
+        (replen_orders if order.commit(boh, True) else slot_orders).append(order)
+
+    sku_hist = {}  # sku: count
+    for order in slot_orders:
+        for sku, qty in order.items.items():
+            if sku not in boh:
+                sku_hist[sku] = sku_hist.get(sku, 0) + qty
+
+    slot_results = []
+    slot_candidates = []
+    for sku in sorted(sku_hist, key=sku_hist.__getitem__, reverse=True):
+        slot_candidates.append(sku)
+        trial_boh = dict(boh)
+        for s in slot_candidates:
+            trial_boh[s] = 0
+        addn_orders = [order for order in slot_orders if order.commit(trial_boh, True)]
+        slot_results.append((list(slot_candidates), addn_orders, trial_boh))
+
+    return ready_orders, replen_orders, slot_results
+
+
+class CheckModesTest(unittest.TestCase):
+    # every alternative check mode must give exactly what check_orders gives
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory(prefix='test_wave_')
+        cls.inputs = [
+            make_inputs(cls.tmp_dir.name, 1),
+            make_inputs(cls.tmp_dir.name, 2, skus=50, lines_per_order=1.05),
+            make_inputs(cls.tmp_dir.name, 3, orders=300, skus=600, lines_per_order=3),
+        ]
+        cls.expected = [cls.check_orders(wave_set, boh) for wave_set, boh in cls.inputs]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    @staticmethod
+    def check_orders(wave_set, boh):
+        orders = wave.load_orders(wave_set)
+        bohs = wave.load_boh(boh)
+        return [plain(wave.check_orders(orders, level_boh), level_boh) for level_boh in bohs]
+
+    def test_reference(self):
+        # boh in its own order too, as the reports write it that way
+        def ordered(stats, boh):
+            result = plain(stats, boh)
+            result['slots'] = [(skus, addn_orders, list(trial_boh.items())) for skus, addn_orders, trial_boh in result['slots']]
+            result['boh'] = list(boh.items())
+            return result
+
+        for wave_set, boh in self.inputs:
+            with self.subTest(wave_set=os.path.basename(wave_set)):
+                orders = wave.load_orders(wave_set)
+                bohs = wave.load_boh(boh)
+                expected = [ordered(reference_check_orders(orders, level_boh), level_boh) for level_boh in bohs]
+                bohs = wave.load_boh(boh)
+                self.assertEqual([ordered(wave.check_orders(orders, level_boh), level_boh) for level_boh in bohs], expected)
+
+    def assert_mode(self, check, load=wave.load_orders):
+        for (wave_set, boh), expected in zip(self.inputs, self.expected):
+            with self.subTest(wave_set=os.path.basename(wave_set)):
+                orders = load(wave_set)
+                bohs = wave.load_boh(boh)
+                order_stats = check(orders, bohs)
+                self.assertEqual([plain(stats, level_boh) for stats, level_boh in zip(order_stats, bohs)], expected)
+
+    def test_slotted(self):
+        def check(orders, bohs):
+            masks = wave.slotted_levels(orders, bohs)
+            return [wave.check_orders(orders, boh, wave.level_mask(masks, level)) for level, boh in enumerate(bohs)]
+        self.assert_mode(check)
+
+    def test_compact(self):
+        self.assert_mode(lambda orders, bohs: [wave.check_orders(orders, boh) for boh in bohs], wave.load_order_store)
+
+    def test_stream(self):
+        self.assert_mode(lambda orders, bohs: [wave.check_orders(orders, boh) for boh in bohs], wave.stream_order_store)
+
+    def test_profiles(self):
+        load = lambda fname: wave.load_orders(fname, profiles=True)
+        self.assert_mode(lambda orders, bohs: [wave.check_orders(orders, boh) for boh in bohs], load)
+
+    def test_vectorize(self):
+        self.assert_mode(wave.check_orders_levels)
+
+    def test_shared_prefix(self):
+        self.assert_mode(wave.check_orders_shared)
+
+    def test_state(self):
+        def check(orders, bohs):
+            state = wave.WaveState(None, orders, bohs)
+            return state.results(bohs)
+        self.assert_mode(check)
+
+    def test_state_update(self):
+        # start from a different boh, then update to the real one
+        def check(orders, bohs):
+            state = wave.WaveState(None, orders, [{sku: qty // 2 for sku, qty in boh.items()} for boh in bohs])
+            state.update(bohs)
+            return state.results(bohs)
+        self.assert_mode(check)
+
+    @unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(), 'needs fork')
+    def test_parallel(self):
+        self.assert_mode(lambda orders, bohs: wave.check_orders_parallel(orders, bohs, 2))
+
+    @unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(), 'needs fork')
+    def test_sharded(self):
+        self.assert_mode(lambda orders, bohs: wave.check_orders_sharded(orders, bohs, 2))
+
+
+class BohOverlayTest(unittest.TestCase):
+    # a view at every slot step must read and iterate like a plain dict
+    def test_plain_dict(self):
+        for seed in range(100):
+            rng = random.Random(seed)
+            skus = [f'k{i}' for i in range(6)]
+            expected = {sku: rng.randrange(5) for sku in skus[:3]}
+            history = wave.BohHistory(dict(expected))
+            for step in range(6):
+                boh = wave.BohOverlay(history, step)
+                for _ in range(rng.randrange(1, 5)):
+                    sku = rng.choice(skus)
+                    if sku in expected and rng.random() < 0.4:
+                        del boh[sku]
+                        del expected[sku]
+                    else:
+                        boh[sku] = expected[sku] = rng.randrange(5)
+
+                    with self.subTest(seed=seed, step=step):
+                        self.assertEqual(sorted(boh), sorted(expected))
+                        self.assertEqual(len(boh), len(expected))
+                        self.assertEqual(dict(boh), expected)
+                boh.push()
+
+
+class WaveServiceTest(unittest.TestCase):
+    # cached results must follow boh and order changes
+    def test_updates(self):
+        with tempfile.TemporaryDirectory(prefix='test_wave_') as tmp_dir:
+            wave_set, boh = make_inputs(tmp_dir, 4, orders=300, skus=100)
+            orders = wave.load_orders(wave_set)
+            bohs = wave.load_boh(boh)
+
+        service = wave.WaveService(wave.WaveState(None, orders, bohs), bohs)
+        sku = next(iter(bohs[2]))
+        expected_bohs = [dict(level_boh) for level_boh in bohs]
+        expected_bohs[2][sku] = 0
+        expected_orders = orders[1:]
+
+        self.assertEqual(service.results(), service.results())
+        service.update_boh({'4': {sku: 0}})
+        self.assertEqual(service.results(), wave.summarize([wave.check_orders(orders, dict(level_boh)) for level_boh in expected_bohs]))
+        service.update_orders({}, [orders[0].ship_id])
+        self.assertEqual(service.results(), wave.summarize([wave.check_orders(expected_orders, level_boh) for level_boh in expected_bohs]))
+
+        with self.assertRaises(TypeError):
+            service.update_orders({}, orders[1].ship_id)
+
+
+class ScenariosTest(unittest.TestCase):
+    def test_levels(self):
+        with tempfile.TemporaryDirectory(prefix='test_wave_') as tmp_dir:
+            fname = os.path.join(tmp_dir, 'scenarios.csv')
+            with open(fname, 'w', newline='') as f:
+                f.write('SCENARIO,LEVEL,PRTNUM,QTY\nx,,A,100\nx,3,B,\n')
+            self.assertEqual(wave.load_scenarios(fname), {'x': {None: {'A': 100}, 3: {'B': None}}})
+
+            # an unknown level must not be silently ignored
+            with open(fname, 'a', newline='') as f:
+                f.write('x,2,A,100\n')
+            with self.assertRaisesRegex(ValueError, 'level 2'):
+                wave.load_scenarios(fname)
+
+
+class ProfileTest(unittest.TestCase):
+    # every run of main must save its own profile, whatever it does
+    def test_main(self):
+        with tempfile.TemporaryDirectory(prefix='test_wave_') as tmp_dir:
+            wave_set, boh = make_inputs(tmp_dir, 7, orders=300, skus=100)
+            scenarios = os.path.join(tmp_dir, 'scenarios.csv')
+            with open(scenarios, 'w', newline='') as f:
+                f.write('SCENARIO,LEVEL,PRTNUM,QTY\n')
+
+            profiles = []
+            for args in ([], [], ['--scenarios', scenarios]):
+                fname = os.path.join(tmp_dir, f'profile_{len(profiles)}.json')
+                with mock.patch('sys.argv', ['wave.py', wave_set, boh, '--profile', fname] + args), mock.patch('sys.stdout'):
+                    wave.main()
+                with open(fname) as f:
+                    profiles.append(json.load(f))
+
+        self.assertGreater(profiles[0]['counters']['order_commit_calls'], 0)
+        self.assertEqual(profiles[1]['counters'], profiles[0]['counters'])
+        self.assertEqual([entry['phase'] for entry in profiles[2]['phases']], ['load_boh', 'load_orders'])
+        self.assertIs(wave.PROFILE, None)
+
+
+# writes the rows of fname as `count` parts named prefix_<i>.csv<suffix>,
+# each with the header row; returns: the glob matching them
+def split_parts(fname, prefix, count, suffix=''):
+    with open(fname, newline='') as f:
+        lines = f.readlines()
+
+    for i in range(count):
+        with wave.open_text(f'{prefix}_{i}.csv{suffix}', 'w') as f:
+            f.writelines([lines[0]] + lines[1 + i::count])
+    return f'{prefix}_*.csv{suffix}'
+
+
+class InputsTest(unittest.TestCase):
+    # every way of reading the same rows must load the same orders and boh
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory(prefix='test_wave_')
+        cls.wave_set, cls.boh = make_inputs(cls.tmp_dir.name, 6, orders=500, skus=100)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def test_parts(self):
+        expected_orders = [(order.ship_id, order.items) for order in wave.load_orders(self.wave_set)]
+        expected_bohs = wave.load_boh(self.boh)
+        for suffix in ('', '.gz', '.xz'):
+            # every other line in another part, so orders span parts
+            wave_set = split_parts(self.wave_set, os.path.join(self.tmp_dir.name, f'wave_parts{suffix}'), 3, suffix)
+            boh = split_parts(self.boh, os.path.join(self.tmp_dir.name, f'boh_parts{suffix}'), 2, suffix)
+            for jobs in (1, 2):
+                with self.subTest(suffix=suffix, jobs=jobs):
+                    self.assertEqual([(order.ship_id, order.items) for order in wave.load_orders(wave_set, jobs=jobs)], expected_orders)
+                    self.assertEqual([(order.ship_id, order.items) for order in wave.load_order_store(wave_set, jobs=jobs)], expected_orders)
+                    self.assertEqual([(order.ship_id, order.items) for order in wave.stream_order_store(wave_set)], expected_orders)
+                    self.assertEqual(wave.load_boh(boh, jobs=jobs), expected_bohs)
+
+    def test_stream(self):
+        # small sorted runs, merged a few at a time first
+        expected_orders = [(order.ship_id, list(order.items.items())) for order in wave.load_orders(self.wave_set)]
+        with mock.patch.object(wave, 'STREAM_MERGE_RUNS', 3), wave.OrderStream(self.wave_set, chunk_bytes=500) as stream:
+            self.assertEqual([(order.ship_id, list(order.items.items())) for order in stream], expected_orders)
+            self.assertFalse(stream.sorted)
+            self.assertLessEqual(len(stream.runs), 3)
+
+    @unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(), 'needs fork')
+    def test_ranges(self):
+        expected_orders = [(order.ship_id, order.items) for order in wave.load_orders(self.wave_set)]
+
+        # ordered by ship_id (ranges are concatenated) and not (ranges are merged)
+        sorted_set = os.path.join(self.tmp_dir.name, 'wave_set_sorted.csv')
+        with open(self.wave_set, newline='') as f:
+            lines = f.readlines()
+        with open(sorted_set, 'w', newline='') as f:
+            f.writelines([lines[0]] + sorted(lines[1:], key=lambda line: line.split(',')[0]))
+
+        for wave_set in (self.wave_set, sorted_set):
+            with self.subTest(wave_set=os.path.basename(wave_set)):
+                ranges = wave.order_ranges(wave_set, 2, size=1000)
+                self.assertGreater(len(ranges), 2)
+                orders = wave.merge_order_ranges(wave.parse_ranges(wave.load_orders_range, wave_set, ranges, 2))
+                self.assertEqual([(order.ship_id, order.items) for order in orders], expected_orders)
+                store = wave.merge_order_stores(wave.parse_ranges(wave.load_store_range, wave_set, ranges, 2))
+                self.assertEqual([(order.ship_id, order.items) for order in store], expected_orders)
+
+
+class CacheTest(unittest.TestCase):
+    # a cache must be reused while its source is unchanged, and rebuilt once it is not
+    def test_invalidation(self):
+        with tempfile.TemporaryDirectory(prefix='test_wave_') as tmp_dir:
+            wave_set, boh = make_inputs(tmp_dir, 8, orders=300, skus=100)
+            cache_dir = os.path.join(tmp_dir, 'cache')
+            orders = lambda: [(order.ship_id, order.items) for order in wave.load_order_store_cached(wave_set, cache_dir, load)]
+
+            load = mock.Mock(side_effect=wave.load_order_store)
+            expected_orders = [(order.ship_id, order.items) for order in wave.load_order_store(wave_set)]
+            with mock.patch.object(wave, 'load_boh', wraps=wave.load_boh) as load_boh:
+                for _ in range(2):
+                    self.assertEqual(wave.load_boh_cached(boh, cache_dir), wave.load_boh(boh))
+                    self.assertEqual(orders(), expected_orders)
+                self.assertEqual(load_boh.call_count, 3)
+            self.assertEqual(load.call_count, 1)
+
+            # a new mtime alone: hashed once, then the refreshed header matches again
+            st = os.stat(wave_set)
+            os.utime(wave_set, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+            with mock.patch.object(wave, 'file_digest', wraps=wave.file_digest) as file_digest:
+                self.assertEqual(orders(), expected_orders)
+                self.assertEqual(orders(), expected_orders)
+                self.assertEqual(file_digest.call_count, 1)
+            self.assertEqual(load.call_count, 1)
+
+            # the same size with other content: rebuilt
+            with open(wave_set, newline='') as f:
+                lines = f.readlines()
+            with open(wave_set, 'w', newline='') as f:
+                f.writelines([lines[0]] + lines[:0:-1])
+            os.utime(wave_set, ns=(st.st_atime_ns, st.st_mtime_ns))
+            expected_orders = [(order.ship_id, order.items) for order in wave.load_order_store(wave_set)]
+            self.assertEqual(orders(), expected_orders)
+            self.assertEqual(load.call_count, 2)
+
+
+# returns: {path relative to top: text} for every file under top, read
+# through open_text (so compressed files come back decompressed, under their
+# uncompressed name)
+def read_tree(top):
+    files = {}
+    for root, dirs, names in os.walk(top):
+        for name in names:
+            path = os.path.join(root, name)
+            key = os.path.relpath(path, top)
+            for _, suffix in wave.CODECS.values():
+                key = key.removesuffix(suffix)
+            with wave.open_text(path) as f:
+                files[key] = f.read()
+    return files
+
+
+class ReportsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory(prefix='test_wave_')
+        cls.wave_set, cls.boh = make_inputs(cls.tmp_dir.name, 5, orders=300, skus=100)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def check(self):
+        orders = wave.load_orders(self.wave_set)
+        bohs = wave.load_boh(self.boh)
+        return [wave.check_orders(orders, boh) for boh in bohs], bohs
+
+    def write(self, name, **kwargs):
+        report_dir = os.path.join(self.tmp_dir.name, name)
+        wave.write_reports(report_dir, *self.check(), **kwargs)
+        return report_dir
+
+    def test_compress(self):
+        expected = read_tree(self.write('plain'))
+        for codec in wave.CODECS:
+            with self.subTest(codec=codec):
+                self.assertEqual(read_tree(self.write(codec, compress=codec)), expected)
+
+    def test_delta(self):
+        # every full slot_N view, rebuilt from the delta reports as manifest.json says
+        full = read_tree(self.write('full'))
+        delta_dir = self.write('delta', mode='delta')
+        delta = read_tree(delta_dir)
+        full_rows = lambda key: list(csv.reader(io.StringIO(full[key])))[1:]
+        rows = lambda key: list(csv.reader(io.StringIO(delta[key])))[1:] if key else []
+
+        checked = 0
+        for level in wave.LEVELS:
+            with open(os.path.join(delta_dir, f'level_{level}', 'manifest.json')) as f:
+                manifest = json.load(f)
+            base = lambda name: manifest[name] and f'level_{level}/{manifest[name]}'
+            orders, sids, skus = [], [], []
+            boh = dict(rows(base('base_boh')))
+            for step in manifest['steps']:
+                slot = f'level_{level}/{step["dir"]}/'
+                orders.append(rows(f'{slot}{level}_{step["dir"]}_orders.csv'))
+                sids.append(rows(f'{slot}{level}_{step["dir"]}_sids.csv'))
+                skus.extend(rows(f'{slot}skus.csv'))
+                boh.update(rows(f'{slot}boh.csv'))
+
+                for name, base_rows, added in (('orders', 'base_orders', orders), ('sids', 'base_sids', sids)):
+                    merged = heapq.merge(*added, key=lambda row: row[0])
+                    self.assertEqual(full_rows(f'{slot}{level}_{step["dir"]}_{name}.csv'), rows(base(base_rows)) + list(merged))
+                self.assertEqual(full_rows(f'{slot}skus.csv'), skus)
+                self.assertEqual(full_rows(f'{slot}boh.csv'), [list(item) for item in boh.items()])
+                checked += 1
+        self.assertGreater(checked, 0)
+
+    def test_db(self):
+        # every level's stages and slot_N views, queried back by step
+        order_stats, bohs = self.check()
+        path = os.path.join(self.tmp_dir.name, 'wave.db')
+        wave.write_report_db(path, order_stats, bohs)
+        orders = wave.load_orders(self.wave_set)
+
+        conn = sqlite3.connect(path)
+        try:
+            lines = {}
+            for ship_id, sku, qty in conn.execute('SELECT ship_id, sku, qty FROM order_lines'):
+                lines.setdefault(ship_id, {})[sku] = qty
+            self.assertEqual(lines, {order.ship_id: order.items for order in orders})
+
+            for level, (ready_orders, replen_orders, slots), boh in zip(wave.LEVELS, order_stats, bohs):
+                query = lambda sql, *args: conn.execute(sql, (level, *args)).fetchall()
+                for stage, stage_orders in (('ready', ready_orders), ('replen', replen_orders)):
+                    self.assertEqual(query('SELECT ship_id FROM wave WHERE level = ? AND stage = ? ORDER BY rowid', stage), [(order.ship_id,) for order in stage_orders])
+                self.assertEqual(dict(query('SELECT sku, qty FROM boh WHERE level = ? AND step = 0')), boh)
+
+                for step, (skus, addn_orders, trial_boh) in enumerate(slots, 1):
+                    with self.subTest(level=level, step=step):
+                        self.assertEqual(query("SELECT ship_id FROM wave WHERE level = ? AND stage = 'slot' AND step <= ? ORDER BY rowid", step), [(order.ship_id,) for order in addn_orders])
+                        self.assertEqual(query('SELECT sku FROM slot_skus WHERE level = ? AND step <= ? ORDER BY step', step), [(sku,) for sku in skus])
+                        latest = query('SELECT sku, qty FROM boh AS b WHERE level = ? AND step = (SELECT MAX(step) FROM boh WHERE level = b.level AND sku = b.sku AND step <= ?)', step)
+                        self.assertEqual(dict(latest), dict(trial_boh))
+
+        finally:
+            conn.close()
+
+    def test_write_error(self):
+        # a failure in the drain thread must reach the writer, not block it
+        open_text = wave.open_text
+        opened = []
+
+        def failing_open(path, mode='r'):
+            opened.append(path)
+            if len(opened) == 3:
+                raise ValueError('no third file')
+            return open_text(path, mode)
+
+        with mock.patch.object(wave, 'open_text', failing_open):
+            with self.assertRaises(ValueError):
+                self.write('failing')
+
+
+if __name__ == '__main__':
+    unittest.main()
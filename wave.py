@@ -1,15 +1,135 @@
 import argparse
+import array
+import bisect
+import bz2
+import collections
+import collections.abc
+import contextlib
 import csv
+import errno
+import functools
+import gc
+import glob
+import gzip
+import hashlib
+import heapq
+import http.server
+import io
+import itertools
+import json
+import lzma
+import mmap
+import multiprocessing
 import os
 import pathlib
+import pickle
+import queue
 import shutil
+import socketserver
+import sqlite3
+import stat
 import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+
+
+# coarse counters (boh copies, slot steps, report rows/bytes), always kept
+COUNTERS = collections.Counter()
+
+# the active Profile when run with --profile
+PROFILE = None
+
+
+class Profile():
+    # wall/cpu time per (nested) phase plus COUNTERS, saved as json by --profile
+    def __init__(self, trace_memory=False):
+        self.phases = []  # {'phase': 'a/b', 'wall_s': .., 'cpu_s': ..}
+        self.stack = []
+        self.trace_memory = trace_memory
+        self.commits = {}  # class: its commit before count_commits
+        COUNTERS.clear()
+        if trace_memory:
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        self.stack.append(name)
+        entry = {'phase': '/'.join(self.stack)}
+        self.phases.append(entry)
+        start, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+
+        finally:
+            entry['wall_s'] = time.perf_counter() - start
+            entry['cpu_s'] = time.process_time() - cpu
+            self.stack.pop()
+
+    # counts Order.commit calls (check workers hand theirs back, see worker_profile);
+    # the ready/replen passes that check orders inline do not call it; save
+    # puts the uncounted commits back
+    def count_commits(self):
+        for cls in (Order, StoredOrder):
+            def counted(order, boh, with_replen, commit=cls.commit):
+                COUNTERS['order_commit_calls'] += 1
+                return commit(order, boh, with_replen)
+            self.commits[cls] = cls.commit
+            cls.commit = counted
+
+    def save(self, fname):
+        for cls, commit in self.commits.items():
+            cls.commit = commit
+        self.commits.clear()
+
+        counters = dict.fromkeys(['order_commit_calls', 'boh_copies', 'slot_steps', 'rows_written', 'files_written', 'bytes_written'], 0)
+        counters.update(COUNTERS)
+        data = {'phases': self.phases, 'counters': counters}
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics('lineno')[:10]
+            data['memory'] = {
+                'current_kb': current // 1024,
+                'peak_kb': peak // 1024,
+                'top': [{'site': str(stat.traceback), 'kb': stat.size // 1024, 'count': stat.count} for stat in top],
+            }
+            tracemalloc.stop()
+
+        with open(fname, 'w') as f:
+            json.dump(data, f, indent=2)
+
+
+def phase(name):
+    return PROFILE.phase(name) if PROFILE else contextlib.nullcontext()
+
+
+# returns: (run(), the COUNTERS and profile phases it recorded), so a forked
+# worker can hand its profile back to the parent (see merge_profile)
+def worker_profile(run):
+    COUNTERS.clear()
+    count = len(PROFILE.phases) if PROFILE else 0
+    result = run()
+    return result, dict(COUNTERS), PROFILE.phases[count:] if PROFILE else []
+
+
+# adds what worker_profile recorded in a worker; worker phases overlap in time
+def merge_profile(counters, phases):
+    COUNTERS.update(counters)
+    if PROFILE:
+        PROFILE.phases.extend(phases)
+
+
+def copy_boh(boh):
+    COUNTERS['boh_copies'] += 1
+    return dict(boh)
 
 
 class Order():
-    def __init__(self, ship_id):
+    def __init__(self, ship_id, items=None):
         self.ship_id = ship_id
-        self.items = {}  # sku: qty
+        self.items = {} if items is None else items  # sku: qty
 
     def add_item(self, sku, qty):
         # TODO: could a sku be repeated within an order?
@@ -33,6 +153,144 @@ class Order():
         return f'order {self.ship_id}: {self.items}'
 
 
+class SlotOrders():
+    # slot orders (in ship_id order) unlocked by the first `count` slotted skus
+    def __init__(self, orders, unlocks, count, size):
+        self.orders = orders
+        self.unlocks = unlocks
+        self.count = count
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for order, step in zip(self.orders, self.unlocks):
+            if step < self.count:
+                yield order
+
+    def __repr__(self):
+        return f'slot orders +{self.count}: {list(self)}'
+
+
+class SlotSkus(collections.abc.Sequence):
+    # the first `count` ranked skus, a view sharing one list across slot steps
+    def __init__(self, skus, count):
+        self.skus = skus
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.skus[:self.count][index]
+        if not -self.count <= index < self.count:
+            raise IndexError(index)
+        return self.skus[index % self.count]
+
+    def __iter__(self):
+        return itertools.islice(self.skus, self.count)
+
+    def __repr__(self):
+        return f'slot skus +{self.count}: {list(self)}'
+
+
+_MISSING = object()
+
+
+class BohHistory():
+    # shared base boh plus, per sku, the qty it takes at each slot step
+    def __init__(self, base):
+        self.base = base
+        self.changes = {}  # sku: ([step, ...], [qty, ...])
+        self.added = []  # skus not in base, in the order they were added
+        self.added_steps = []
+
+    def get(self, sku, step, default=_MISSING):
+        change = self.changes.get(sku)
+        if change:
+            i = bisect.bisect_right(change[0], step) - 1
+            if i >= 0:
+                return change[1][i]
+        return self.base.get(sku, default)
+
+    def push(self, step, delta):
+        for sku, qty in delta.items():
+            change = self.changes.get(sku)
+            if not change:
+                change = ([], [])
+                self.changes[sku] = change
+                if sku not in self.base:
+                    self.added.append(sku)
+                    self.added_steps.append(step)
+            if change[0] and change[0][-1] == step:
+                change[1][-1] = qty
+            else:
+                change[0].append(step)
+                change[1].append(qty)
+
+
+class BohOverlay(collections.abc.MutableMapping):
+    # boh as of one slot step; writes stay local to this view (copy-on-write)
+    def __init__(self, history, step):
+        self.history = history
+        self.step = step
+        self.delta = {}  # sku: qty (or _MISSING if deleted)
+
+    def push(self):
+        # fold this view's writes into the shared history as its slot step
+        self.history.push(self.step, self.delta)
+        self.delta = {}
+
+    def _get(self, sku):
+        qty = self.delta.get(sku, _MISSING)
+        if qty is _MISSING and sku not in self.delta:
+            qty = self.history.get(sku, self.step)
+        return qty
+
+    def __getitem__(self, sku):
+        qty = self._get(sku)
+        if qty is _MISSING:
+            raise KeyError(sku)
+        return qty
+
+    def __setitem__(self, sku, qty):
+        self.delta[sku] = qty
+
+    def __delitem__(self, sku):
+        if self._get(sku) is _MISSING:
+            raise KeyError(sku)
+        self.delta[sku] = _MISSING
+
+    def __contains__(self, sku):
+        return self._get(sku) is not _MISSING
+
+    def __iter__(self):
+        history = self.history
+        for sku in history.base:
+            if (sku not in history.changes and sku not in self.delta) or sku in self:
+                yield sku
+
+        count = bisect.bisect_right(history.added_steps, self.step)
+        for sku in history.added[:count]:
+            if sku in self:
+                yield sku
+
+        # skus new to this view (not already yielded above as added by now)
+        for sku, qty in self.delta.items():
+            if qty is not _MISSING and sku not in history.base:
+                change = history.changes.get(sku)
+                if not change or change[0][0] > self.step:
+                    yield sku
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f'boh @{self.step}: {dict(self)}'
+
+
 def append_boh(row, boh, offset):
     slot = row[offset+4]
     if slot:
@@ -40,10 +298,136 @@ def append_boh(row, boh, offset):
         boh[row[0]] = qty
 
 
-# returns: list of boh dictionaries (sku: qty avail)
-def load_boh(fname):
+LEVELS = [1, 3, 4, 6]
+
+# stdlib codecs for compressed inputs and reports: name: (open, file suffix);
+# gzip and bz2 write at level 6 (their default 9 is several times slower for
+# about the same ratio on report CSVs), xz already defaults to preset 6
+CODECS = {
+    'gzip': (functools.partial(gzip.open, compresslevel=6), '.gz'),
+    'bz2': (functools.partial(bz2.open, compresslevel=6), '.bz2'),
+    'xz': (lzma.open, '.xz'),
+}
+
+
+# returns: text file object for fname, streamed through a codec if its
+# suffix is one of CODECS
+def open_text(fname, mode='r'):
+    for codec_open, suffix in CODECS.values():
+        if fname.endswith(suffix):
+            return codec_open(fname, mode + 't', newline='')
+
+    return open(fname, mode, newline='')
+
+
+# returns: the input files for fname: the sorted matches if it is a glob
+# pattern (and not an existing file), else just fname
+def input_parts(fname):
+    if os.path.exists(fname) or glob.escape(fname) == fname:
+        return [fname]
+
+    parts = sorted(glob.glob(fname))
+    if not parts:
+        raise FileNotFoundError(errno.ENOENT, 'no input files match', fname)
+    return parts
+
+
+# returns: (total size, latest mtime_ns) of the input files for fname
+def input_stat(fname):
+    stats = [os.stat(part) for part in input_parts(fname)]
+    return sum(st.st_size for st in stats), max(st.st_mtime_ns for st in stats)
+
+
+# yields: the rows of every input file for fname in turn, without their header rows
+def input_rows(fname):
+    for part in input_parts(fname):
+        with open_text(part) as f:
+            reader = csv.reader(f)
+            headers = next(reader, None)
+            yield from reader
+
+
+# returns: how many worker processes to fork for jobs; 1 where fork is
+# unavailable or inside a pool worker, which cannot have children
+def fork_jobs(jobs=1):
+    if multiprocessing.current_process().daemon or 'fork' not in multiprocessing.get_all_start_methods():
+        return 1
+
+    return max(jobs, 1)
+
+
+# returns: parse(part) for every input file for fname, in order; several
+# parts are parsed concurrently by up to jobs (see fork_jobs) forked workers
+def parse_parts(parse, fname, jobs=1):
+    parts = input_parts(fname)
+    jobs = min(fork_jobs(jobs), len(parts))
+    if jobs > 1:
+        with multiprocessing.get_context('fork').Pool(jobs) as pool:
+            return pool.map(parse, parts)
+
+    return [parse(part) for part in parts]
+
+
+ORDER_RANGE_BYTES = 1 << 25
+
+
+# pauses the cyclic gc: building millions of long-lived objects (none of them
+# in cycles) otherwise triggers repeated full passes over all of them
+@contextlib.contextmanager
+def gc_paused():
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+
+    finally:
+        if enabled:
+            gc.enable()
+
+
+# returns: (start, end) byte offsets splitting the rows of wave_set fname into
+# ranges of about size bytes, each ending at a newline, or None when fname is
+# not worth splitting (compressed, multi-part, one range or one job); quoted
+# fields must not contain newlines
+def order_ranges(fname, jobs=1, size=ORDER_RANGE_BYTES):
+    if fork_jobs(jobs) < 2 or input_parts(fname) != [fname] or fname.endswith(tuple(suffix for _, suffix in CODECS.values())):
+        return None
+
+    ranges = []
+    with open(fname, 'rb') as f:
+        f.readline()
+        start = f.tell()
+        end_of_file = os.fstat(f.fileno()).st_size
+        while start < end_of_file:
+            f.seek(min(start + size, end_of_file))
+            f.readline()
+            ranges.append((start, f.tell()))
+            start = f.tell()
+
+    return ranges if len(ranges) > 1 else None
+
+
+# returns: csv reader over the rows of fname between byte offsets start and
+# end, decoded like open_text
+def range_rows(fname, start, end):
+    with open(fname, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    return csv.reader(io.TextIOWrapper(io.BytesIO(data), newline=''))
+
+
+# yields: parse((fname, start, end)) for every range, in order, from forked workers
+def parse_ranges(parse, fname, ranges, jobs=1):
+    ctx = multiprocessing.get_context('fork')
+    with ctx.Pool(min(fork_jobs(jobs), len(ranges))) as pool:
+        yield from pool.imap(parse, [(fname, start, end) for start, end in ranges])
+
+
+# returns: list of boh dictionaries (sku: qty avail) for one input file
+def load_boh_part(fname):
     bohs = [{}, {}, {}, {}]
-    with open(fname, 'r') as f:
+    with open_text(fname) as f:
         reader = csv.reader(f)
 
         # skip headers: PRTNUM,Available Qty 1,Available Qty 3,Available Qty 4,Available Qty 6,LEVEL 1 LOCATION,LEVEL 3 LOCATION,LEVEL 4 LOCATION,LEVEL 6 LOCATION
@@ -56,48 +440,655 @@ def load_boh(fname):
     return bohs
 
 
-# returns: list of Order, sorted by ship_id
-def load_orders(fname):
-    orders_by_id = {}   # ship_id: Order
-    with open(fname, 'r') as f:
-        reader = csv.reader(f)
+# returns: list of boh dictionaries (sku: qty avail)
+# fname: a file, or a glob of parts merged in sorted order (a later row for a
+# sku replaces an earlier one, as within one file)
+def load_boh(fname, jobs=1):
+    parts = parse_parts(load_boh_part, fname, jobs)
+    bohs = parts[0]
+    for part in parts[1:]:
+        for boh, part_boh in zip(bohs, part):
+            boh.update(part_boh)
 
-        # skip headers: SHIP_ID,PRTNUM,WAVE_SET,ORDQTY
-        headers = next(reader)
+    return bohs
 
-        for row in reader:
-            ship_id = row[0]
-            order = orders_by_id.get(ship_id)
-            if not order:
-                order = Order(ship_id)
-                orders_by_id[ship_id] = order
-            order.add_item(row[1], int(row[3]))
 
-    sorted_items = sorted(orders_by_id.items())
-    sorted_orders = [x[1] for x in sorted_items]
+# returns: {ship_id: Order} for wave_set rows (SHIP_ID,PRTNUM,WAVE_SET,ORDQTY)
+def group_orders(rows):
+    orders_by_id = {}   # ship_id: Order
+    for row in rows:
+        ship_id = row[0]
+        order = orders_by_id.get(ship_id)
+        if not order:
+            order = Order(ship_id)
+            orders_by_id[ship_id] = order
+        order.add_item(row[1], int(row[3]))
+
+    return orders_by_id
+
+
+# returns: {ship_id: Order} for one input file
+def load_orders_part(fname):
+    return group_orders(input_rows(fname))
+
+
+# returns: (ship_ids, items dict per ship_id), sorted by ship_id, for the rows
+# in one byte range of a file; plain data, which is cheaper to send back from
+# a worker than Order objects
+def load_orders_range(task):
+    orders_by_id = group_orders(range_rows(*task))
+    ship_ids = sorted(orders_by_id)
+    return ship_ids, [orders_by_id[ship_id].items for ship_id in ship_ids]
+
+
+# returns: {ship_id: Order} merging parts of {ship_id: Order} in order (an
+# order in several parts gets the lines of all of them)
+def merge_orders(parts):
+    parts = iter(parts)
+    orders_by_id = next(parts)
+    for part in parts:
+        for ship_id in part.keys() & orders_by_id.keys():
+            merged = orders_by_id[ship_id]
+            for sku, qty in part.pop(ship_id).items.items():
+                merged.add_item(sku, qty)
+        orders_by_id.update(part)
+
+    return orders_by_id
+
+
+# returns: list of Order, sorted by ship_id, from load_orders_range results of
+# consecutive ranges; ranges holding ascending runs of ship_ids (a file already
+# ordered by ship_id, where only an order split at a range boundary is in two
+# ranges) are concatenated, anything else is merged
+def merge_order_ranges(parts):
+    parts = [part for part in parts if part[0]]
+    if all(a[0][-1] <= b[0][0] for a, b in zip(parts, parts[1:])):
+        orders = []
+        for ship_ids, items in parts:
+            first = 0
+            if orders and orders[-1].ship_id == ship_ids[0]:
+                for sku, qty in items[0].items():
+                    orders[-1].add_item(sku, qty)
+                first = 1
+            orders.extend(map(Order, itertools.islice(ship_ids, first, None), itertools.islice(items, first, None)))
+        return orders
+
+    orders_by_id = merge_orders(dict(zip(ship_ids, map(Order, ship_ids, items))) for ship_ids, items in parts)
+    return [orders_by_id[ship_id] for ship_id in sorted(orders_by_id)]
+
+
+# returns: list of Order, sorted by ship_id
+# fname: a file, or a glob of parts merged in sorted order (an order split
+# across parts gets the lines of all of them)
+# profiles: share one items dict between orders with identical lines
+# jobs: worker processes for parsing parts, or byte ranges of a large plain
+# file (see order_ranges), concurrently
+def load_orders(fname, profiles=False, jobs=1):
+    ranges = order_ranges(fname, jobs)
+    if ranges:
+        with gc_paused():
+            sorted_orders = merge_order_ranges(parse_ranges(load_orders_range, fname, ranges, jobs))
+
+    else:
+        orders_by_id = merge_orders(parse_parts(load_orders_part, fname, jobs))
+        sorted_items = sorted(orders_by_id.items())
+        sorted_orders = [x[1] for x in sorted_items]
+
+    if profiles:
+        sorted_orders = share_profiles(sorted_orders)
 
     return sorted_orders
 
 
-def check_orders(orders, boh):
+# returns: list of Order where orders with identical lines share one items dict
+# (Order objects are reused, anything Order-like is copied into one)
+def share_profiles(orders):
+    profiles = {}  # lines: items
+    shared = []
+    for order in orders:
+        if not isinstance(order, Order):
+            order = Order(order.ship_id, order.items)
+        order.items = profiles.setdefault(tuple(order.items.items()), order.items)
+        shared.append(order)
+
+    return shared
+
+
+class OrderStore():
+    # orders in columnar form: skus and ship ids interned to dense int ids, and
+    # order lines in CSR arrays (lines of order i are offsets[i]:offsets[i+1])
+    def __init__(self):
+        self.skus = []  # sku id: sku
+        self.sku_ids = {}  # sku: sku id
+        self.ship_ids = []  # order id: ship_id
+        self.offsets = array.array('q', [0])
+        self.line_skus = array.array('l')
+        self.line_qtys = array.array('q')
+
+    def intern(self, sku):
+        sku_id = self.sku_ids.get(sku)
+        if sku_id is None:
+            sku_id = len(self.skus)
+            self.skus.append(sku)
+            self.sku_ids[sku] = sku_id
+        return sku_id
+
+    # items: iterable of (sku id, qty), one per sku
+    def append(self, ship_id, items):
+        self.ship_ids.append(ship_id)
+        for sku_id, qty in items:
+            self.line_skus.append(sku_id)
+            self.line_qtys.append(qty)
+        self.offsets.append(len(self.line_skus))
+
+    def __len__(self):
+        return len(self.ship_ids)
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self.ship_ids):
+            raise IndexError(index)
+        return StoredOrder(self, index)
+
+    def __iter__(self):
+        for index in range(len(self.ship_ids)):
+            yield StoredOrder(self, index)
+
+
+class StoredOrder():
+    # an Order-like view of one order in an OrderStore
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    @property
+    def ship_id(self):
+        return self.store.ship_ids[self.index]
+
+    def lines(self):
+        store = self.store
+        skus = store.skus
+        for i in range(store.offsets[self.index], store.offsets[self.index + 1]):
+            yield skus[store.line_skus[i]], store.line_qtys[i]
+
+    @property
+    def items(self):
+        return dict(self.lines())
+
+    def commit(self, boh, with_replen):
+        lines = list(self.lines())
+        for sku, qty in lines:
+            if sku not in boh or (boh[sku] < qty and not with_replen):
+                return False
+
+        for sku, qty in lines:
+            boh[sku] -= qty
+
+        return True
+
+    def __repr__(self):
+        return f'order {self.ship_id}: {self.items}'
+
+
+# returns: OrderStore for wave_set rows (SHIP_ID,PRTNUM,WAVE_SET,ORDQTY), sorted by ship_id
+def store_rows(rows):
+    store = OrderStore()
+    order_ids = {}  # ship_id: id in file order
+    line_orders = array.array('l')
+    line_skus = array.array('l')
+    line_qtys = array.array('q')
+    for row in rows:
+        line_orders.append(order_ids.setdefault(row[0], len(order_ids)))
+        line_skus.append(store.intern(row[1]))
+        line_qtys.append(int(row[3]))
+
+    # group lines by order (keeping file order within each order)
+    ship_ids = list(order_ids)
+    starts = array.array('q', [0]) * (len(ship_ids) + 1)
+    for order_id in line_orders:
+        starts[order_id + 1] += 1
+    for i in range(len(ship_ids)):
+        starts[i + 1] += starts[i]
+    grouped = array.array('q', [0]) * len(line_orders)
+    fill = array.array('q', starts)
+    for line, order_id in enumerate(line_orders):
+        grouped[fill[order_id]] = line
+        fill[order_id] += 1
+
+    for order_id in sorted(range(len(ship_ids)), key=ship_ids.__getitem__):
+        items = {}  # sku id: qty
+        for i in range(starts[order_id], starts[order_id + 1]):
+            line = grouped[i]
+            sku_id = line_skus[line]
+            items[sku_id] = items.get(sku_id, 0) + line_qtys[line]
+        store.append(ship_ids[order_id], items.items())
+
+    return store
+
+
+# returns: OrderStore for the rows in one byte range of a file
+def load_store_range(task):
+    return store_rows(range_rows(*task))
+
+
+# returns: OrderStore merging OrderStores of consecutive parts of one file;
+# ranges holding ascending runs of ship_ids (a file already ordered by ship_id,
+# where only an order split at a range boundary is in two ranges) are
+# concatenated, anything else is merged order by order
+def merge_order_stores(stores):
+    stores = [store for store in stores if len(store)]
+    if len(stores) <= 1:
+        return stores[0] if stores else OrderStore()
+
+    merged = OrderStore()
+    sku_maps = [[merged.intern(sku) for sku in store.skus] for store in stores]
+
+    if all(a.ship_ids[-1] <= b.ship_ids[0] for a, b in zip(stores, stores[1:])):
+        for store, sku_map in zip(stores, sku_maps):
+            first = 0
+            if merged.ship_ids and merged.ship_ids[-1] == store.ship_ids[0]:
+                # the order split at the boundary: replace the last order with both halves
+                start = merged.offsets[-2]
+                items = dict(zip(merged.line_skus[start:], merged.line_qtys[start:]))  # sku id: qty
+                for line in range(store.offsets[0], store.offsets[1]):
+                    sku_id = sku_map[store.line_skus[line]]
+                    items[sku_id] = items.get(sku_id, 0) + store.line_qtys[line]
+                del merged.line_skus[start:]
+                del merged.line_qtys[start:]
+                merged.offsets.pop()
+                merged.append(merged.ship_ids.pop(), items.items())
+                first = 1
+
+            lines = store.offsets[first]
+            merged.ship_ids.extend(itertools.islice(store.ship_ids, first, None))
+            merged.offsets.extend(map((len(merged.line_skus) - lines).__add__, store.offsets[first + 1:]))
+            merged.line_skus.extend(map(sku_map.__getitem__, store.line_skus[lines:]))
+            merged.line_qtys.extend(store.line_qtys[lines:])
+        return merged
+
+    # ties on ship_id come from earlier parts first, which keeps file order
+    entries = heapq.merge(*[zip(store.ship_ids, itertools.repeat(i), range(len(store))) for i, store in enumerate(stores)])
+    for ship_id, group in itertools.groupby(entries, key=lambda entry: entry[0]):
+        items = {}  # sku id: qty
+        for _, i, index in group:
+            store, sku_map = stores[i], sku_maps[i]
+            for line in range(store.offsets[index], store.offsets[index + 1]):
+                sku_id = sku_map[store.line_skus[line]]
+                items[sku_id] = items.get(sku_id, 0) + store.line_qtys[line]
+        merged.append(ship_id, items.items())
+
+    return merged
+
+
+# returns: OrderStore, sorted by ship_id
+# jobs: worker processes for parsing byte ranges of a large plain file (see
+# order_ranges) concurrently, each into its own grouped OrderStore
+def load_order_store(fname, jobs=1):
+    ranges = order_ranges(fname, jobs)
+    if ranges:
+        with gc_paused():
+            return merge_order_stores(parse_ranges(load_store_range, fname, ranges, jobs))
+
+    return store_rows(input_rows(fname))
+
+
+# returns: OrderStore built from an iterable of Order, kept in the same order
+def store_orders(orders):
+    store = OrderStore()
+    for order in orders:
+        store.append(order.ship_id, [(store.intern(sku), qty) for sku, qty in order.items.items()])
+
+    return store
+
+
+# csv text per sorted run when spilling an unsorted wave_set; as rows of
+# python strs a chunk takes several times this in memory
+STREAM_CHUNK_BYTES = 1 << 21
+
+# most runs open at once; more are first merged into longer runs
+STREAM_MERGE_RUNS = 256
+
+
+class OrderStream():
+    # re-iterable stream of Order, sorted by ship_id, read from a wave_set file
+    # without holding its rows: a file already grouped and ordered by ship_id
+    # is read as is, anything else is sorted in chunks of about chunk_bytes to
+    # temp files and merged
+    def __init__(self, fname, chunk_bytes=STREAM_CHUNK_BYTES):
+        self.fname = fname
+        self.chunk_bytes = chunk_bytes
+        self.sorted = None
+        self.tmp_dir = None
+        self.runs = []
+
+    def close(self):
+        if self.tmp_dir:
+            self.tmp_dir.cleanup()
+            self.tmp_dir = None
+            self.runs = []
+        self.sorted = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def rows(self):
+        # rows: SHIP_ID,PRTNUM,WAVE_SET,ORDQTY
+        return input_rows(self.fname)
+
+    def check_sorted(self):
+        prev = None
+        for row in self.rows():
+            if prev is not None and row[0] < prev:
+                return False
+            prev = row[0]
+        return True
+
+    def chunks(self):
+        # rows in lists of about chunk_bytes of csv text each
+        chunk = []
+        size = 0
+        for row in self.rows():
+            chunk.append(row)
+            size += sum(map(len, row)) + len(row)
+            if size >= self.chunk_bytes:
+                yield chunk
+                chunk = []
+                size = 0
+
+        if chunk:
+            yield chunk
+
+    def spill(self):
+        self.tmp_dir = tempfile.TemporaryDirectory(prefix='wave_set_')
+        for chunk in self.chunks():
+            # stable, so lines keep their file order within an order
+            chunk.sort(key=lambda row: row[0])
+            run = os.path.join(self.tmp_dir.name, f'run_{len(self.runs)}.csv')
+            with open(run, 'w', newline='') as f:
+                csv.writer(f).writerows(chunk)
+            self.runs.append(run)
+            del chunk  # before the next one is read
+
+        merges = 0
+        while len(self.runs) > STREAM_MERGE_RUNS:
+            run = os.path.join(self.tmp_dir.name, f'merge_{merges}.csv')
+            merges += 1
+            with open(run, 'w', newline='') as f:
+                csv.writer(f).writerows(self.merged_rows(self.runs[:STREAM_MERGE_RUNS]))
+            for merged in self.runs[:STREAM_MERGE_RUNS]:
+                os.remove(merged)
+            # first, as it holds the earliest lines (ties keep file order)
+            self.runs = [run] + self.runs[STREAM_MERGE_RUNS:]
+
+    def merged_rows(self, runs):
+        files = [open(run, 'r', newline='') for run in runs]
+        try:
+            # ties come from earlier runs first, which keeps file order
+            yield from heapq.merge(*[csv.reader(f) for f in files], key=lambda row: row[0])
+
+        finally:
+            for f in files:
+                f.close()
+
+    def __iter__(self):
+        if self.sorted is None:
+            self.sorted = self.check_sorted()
+            if not self.sorted:
+                self.spill()
+
+        rows = self.rows() if self.sorted else self.merged_rows(self.runs)
+        for ship_id, lines in itertools.groupby(rows, key=lambda row: row[0]):
+            order = Order(ship_id)
+            for row in lines:
+                order.add_item(row[1], int(row[3]))
+            yield order
+
+
+# returns: OrderStore built from an OrderStream over fname, whose temp runs
+# are removed as soon as the store is built
+def stream_order_store(fname):
+    with OrderStream(fname) as stream:
+        return store_orders(stream)
+
+
+# parsed-input cache: one file per (source path, kind) holding a json header
+# followed by 8-byte aligned sections, either raw arrays (mapped in place on
+# load) or NUL-separated strings; a cache is valid while the source has the
+# same size and mtime, or the same size and content hash
+CACHE_MAGIC = b'WAVECACH'
+CACHE_VERSION = 1
+
+
+def file_digest(fname):
+    digest = hashlib.sha256()
+    for part in input_parts(fname):
+        with open(part, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_path(cache_dir, fname, kind):
+    key = hashlib.sha256(f'{kind}:{os.path.abspath(fname)}'.encode()).hexdigest()[:24]
+    return os.path.join(cache_dir, f'{kind}_{key}.bin')
+
+
+def read_cache(cache_dir, fname, kind):
+    path = cache_path(cache_dir, fname, kind)
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+
+    with f:
+        if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+            return None
+        header_len = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(header_len))
+        if header.get('version') != CACHE_VERSION:
+            return None
+
+        size, mtime_ns = input_stat(fname)
+        source = header['source']
+        if source['size'] != size:
+            return None
+        if source['mtime_ns'] != mtime_ns:
+            if source['sha256'] != file_digest(fname):
+                return None
+            refresh_cache(path, header, header_len, mtime_ns)
+
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    sections = {}
+    for name, (offset, size, typecode, count) in header['sections'].items():
+        view = memoryview(mm)[offset:offset + size]
+        if typecode == 's':
+            sections[name] = view.tobytes().decode().split('\0') if count else []
+        else:
+            sections[name] = view.cast(typecode)
+    return sections
+
+
+# records mtime_ns in the header of a cache whose source only got a new mtime
+# (same content hash), so later runs skip the hash again; the header is
+# rewritten in place, padded to its old length so the sections stay put
+def refresh_cache(path, header, header_len, mtime_ns):
+    header['source']['mtime_ns'] = mtime_ns
+    encoded = json.dumps(header).encode()
+    if len(encoded) > header_len:
+        return
+
+    try:
+        with open(path, 'r+b') as f:
+            f.seek(len(CACHE_MAGIC) + 8)
+            f.write(encoded.ljust(header_len))
+    except OSError:
+        pass
+
+
+# sections: name: list of str or array.array
+def write_cache(cache_dir, fname, kind, sections):
+    os.makedirs(cache_dir, exist_ok=True)
+    size, mtime_ns = input_stat(fname)
+    header = {
+        'version': CACHE_VERSION,
+        'source': {'path': os.path.abspath(fname), 'size': size, 'mtime_ns': mtime_ns, 'sha256': file_digest(fname)},
+        'sections': {},
+    }
+
+    blobs = []
+    offset = 0
+    for name, value in sections.items():
+        if isinstance(value, array.array):
+            blob, typecode = value.tobytes(), value.typecode
+        else:
+            blob, typecode = '\0'.join(value).encode(), 's'
+        header['sections'][name] = [offset, len(blob), typecode, len(value)]
+        blobs.append(blob + bytes(-len(blob) % 8))
+        offset += len(blobs[-1])
+
+    # section offsets are relative until the header size is known
+    header_len = 0
+    while True:
+        base = len(CACHE_MAGIC) + 8 + header_len
+        base += -base % 8
+        encoded = json.dumps({**header, 'sections': {name: [o + base, n, t, c] for name, (o, n, t, c) in header['sections'].items()}}).encode()
+        if len(encoded) == header_len:
+            break
+        header_len = len(encoded)
+
+    path = cache_path(cache_dir, fname, kind)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(CACHE_MAGIC)
+        f.write(header_len.to_bytes(8, 'little'))
+        f.write(encoded)
+        f.write(bytes(base - len(CACHE_MAGIC) - 8 - header_len))
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp, path)
+
+
+def load_boh_cached(fname, cache_dir, jobs=1):
+    sections = read_cache(cache_dir, fname, 'boh')
+    if sections is None:
+        bohs = load_boh(fname, jobs)
+        skus = list({sku: None for boh in bohs for sku in boh})
+        sku_ids = {sku: i for i, sku in enumerate(skus)}
+        sections = {'skus': skus}
+        for level, boh in enumerate(bohs):
+            sections[f'skus_{level}'] = array.array('q', [sku_ids[sku] for sku in boh])
+            sections[f'qtys_{level}'] = array.array('q', boh.values())
+        write_cache(cache_dir, fname, 'boh', sections)
+        return bohs
+
+    skus = sections['skus']
+    bohs = []
+    for level in range(4):
+        sku_ids = sections[f'skus_{level}']
+        bohs.append(dict(zip([skus[i] for i in sku_ids], sections[f'qtys_{level}'])))
+    return bohs
+
+
+# load: function building an OrderStore on a cache miss
+def load_order_store_cached(fname, cache_dir, load=load_order_store):
+    sections = read_cache(cache_dir, fname, 'orders')
+    if sections is None:
+        store = load(fname)
+        write_cache(cache_dir, fname, 'orders', {
+            'skus': store.skus,
+            'ship_ids': store.ship_ids,
+            'offsets': store.offsets,
+            'line_skus': store.line_skus,
+            'line_qtys': store.line_qtys,
+        })
+        return store
+
+    store = OrderStore()
+    store.skus = sections['skus']
+    store.sku_ids = {sku: i for i, sku in enumerate(store.skus)}
+    store.ship_ids = sections['ship_ids']
+    store.offsets = sections['offsets']
+    store.line_skus = sections['line_skus']
+    store.line_qtys = sections['line_qtys']
+    return store
+
+
+# slotted: optional, per order position, whether all its skus are in boh (see slotted_levels)
+# rank: orders the missing skus for slotting (see SLOT_RANKINGS)
+def check_orders(orders, boh, slotted=None, rank=None):
+    with phase('ready_replen'):
+        ready_orders, replen_orders, slot_orders, sku_hist = check_ready_replen(orders, boh, slotted)
+    with phase('slotting'):
+        return ready_orders, replen_orders, check_slots(slot_orders, sku_hist, boh, rank)
+
+
+# returns: ready orders, replen orders, slot orders, missing sku counts
+def check_ready_replen(orders, boh, slotted=None):
     ready_orders = []
+    retry_orders = []
+
+    # check only ready-to-ship first
+    if slotted is None:
+        retry_slotted = None
+        for order in orders:
+            if order.commit(boh, False):
+                ready_orders.append(order)
+
+            else:
+                retry_orders.append(order)
+
+    else:
+        retry_slotted = bytearray()  # per retry order: its slotted flag
+        for order, is_slotted in zip(orders, slotted):
+            if is_slotted:
+                # every sku is in boh, so only the qtys need checking
+                items = order.items.items()
+                for sku, qty in items:
+                    if boh[sku] < qty:
+                        break
+
+                else:
+                    for sku, qty in items:
+                        boh[sku] -= qty
+                    ready_orders.append(order)
+                    continue
+
+            retry_orders.append(order)
+            retry_slotted.append(is_slotted)
+
+    # of the remaining orders, check replen vs. slotting
+    replen_orders, slot_orders, sku_hist = check_replen(retry_orders, boh, retry_slotted)
+
+    return ready_orders, replen_orders, slot_orders, sku_hist
+
+
+# retry_orders: the orders not ready to ship
+# slotted: optional, per retry order, whether all its skus are in boh
+# returns: replen orders, slot orders, missing sku counts
+def check_replen(retry_orders, boh, slotted=None):
     replen_orders = []
     slot_orders = []
     sku_hist = {}  # sku: count
 
-    retry_orders = []
+    for order, is_slotted in zip(retry_orders, itertools.repeat(None) if slotted is None else slotted):
+        if is_slotted is None:
+            can_commit = order.commit(boh, True)
 
-    # check only ready-to-ship first
-    for order in orders:
-        if order.commit(boh, False):
-            ready_orders.append(order)
+        elif is_slotted:
+            # replen only needs the skus to be slotted, which is already known
+            for sku, qty in order.items.items():
+                boh[sku] -= qty
+            can_commit = True
 
         else:
-            retry_orders.append(order)
+            can_commit = False
 
-    # of the remaining orders, check replen vs. slotting
-    for order in retry_orders:
-        if order.commit(boh, True):
+        if can_commit:
             replen_orders.append(order)
 
         else:
@@ -111,28 +1102,1213 @@ def check_orders(orders, boh):
                         sku_hist[sku] = 0
                     sku_hist[sku] += qty
 
-    # sort missing skus by count (descending) 
-    ordered_skus = sorted(sku_hist.keys(), key=sku_hist.__getitem__, reverse=True)
+    return replen_orders, slot_orders, sku_hist
+
+
+# returns: missing skus by count (descending)
+def rank_by_count(slot_orders, sku_hist):
+    return sorted(sku_hist.keys(), key=sku_hist.__getitem__, reverse=True)
+
+
+# returns: missing skus, each picked to unlock the most slot orders not yet
+# unlocked (ties and dead ends fall back to rank_by_count)
+def rank_by_coverage(slot_orders, sku_hist):
+    tiebreak = {sku: i for i, sku in enumerate(rank_by_count(slot_orders, sku_hist))}
+
+    # sku_hist holds exactly the skus the slot orders are missing
+    missing = []  # per slot order: its missing skus
+    remaining = []  # per slot order: how many of them are not slotted yet
+    orders_by_sku = {}  # sku: [slot order position, ...]
+    gains = dict.fromkeys(sku_hist, 0)  # sku: orders it would unlock on its own
+    for i, order in enumerate(slot_orders):
+        skus = [sku for sku in order.items if sku in sku_hist]
+        missing.append(skus)
+        remaining.append(len(skus))
+        for sku in skus:
+            orders_by_sku.setdefault(sku, []).append(i)
+        if len(skus) == 1:
+            gains[skus[0]] += 1
+
+    # gains only ever grow, so a popped entry is current iff it matches gains;
+    # every increase pushes a fresh entry
+    heap = [(-gains[sku], tiebreak[sku], sku) for sku in sku_hist]
+    heapq.heapify(heap)
+
+    ordered_skus = []
+    slotted = set()
+    while heap:
+        gain, _, sku = heapq.heappop(heap)
+        if sku in slotted or -gain != gains[sku]:
+            continue
+
+        slotted.add(sku)
+        ordered_skus.append(sku)
+        for i in orders_by_sku.get(sku, ()):
+            remaining[i] -= 1
+            if remaining[i] == 1:
+                last = next(s for s in missing[i] if s not in slotted)
+                gains[last] += 1
+                heapq.heappush(heap, (-gains[last], tiebreak[last], last))
+
+    return ordered_skus
+
+
+SLOT_RANKINGS = {
+    'count': rank_by_count,
+    'coverage': rank_by_coverage,
+}
+
+
+# returns: list of (slotted skus, orders added, boh) per slot step
+def check_slots(slot_orders, sku_hist, boh, rank=None):
+    ordered_skus = (rank or rank_by_count)(slot_orders, sku_hist)
+    COUNTERS['slot_steps'] += len(ordered_skus)
+
+    # a slot order ships (with replen) exactly when the highest-ranked of its
+    # missing skus is slotted, so the whole +N SKU curve falls out of one pass
+    ranks = {sku: i for i, sku in enumerate(ordered_skus)}
+    unlocks = []  # per slot order: index of the slot step that unlocks it
+    unlocked = [[] for _ in ordered_skus]  # per slot step: orders it unlocks
+    for order in slot_orders:
+        # ranks only holds missing skus, so slotted ones need no boh lookup
+        step = max(ranks.get(sku, -1) for sku in order.items)
+        unlocks.append(step)
+        unlocked[step].append(order)
 
     slot_results = []
 
-    slot_candidates = []
-    for sku in ordered_skus:
-        slot_candidates.append(sku)
+    # each step's boh is a view over the post-replen boh plus per-step deltas
+    history = BohHistory(boh)
+    addn_count = 0
+    for i, sku in enumerate(ordered_skus):
+        trial_boh = BohOverlay(history, i)
+        trial_boh[sku] = 0
+        for order in unlocked[i]:
+            order.commit(trial_boh, True)
+        trial_boh.push()
+        addn_count += len(unlocked[i])
+
+        addn_orders = SlotOrders(slot_orders, unlocks, i + 1, addn_count)
+        slot_results.append((SlotSkus(ordered_skus, i + 1), addn_orders, trial_boh))
+
+    return slot_results
+
+
+# same as check_orders for each boh, but the ready pass is run once for the
+# orders before the first one with a sku whose qty differs between levels
+def check_orders_shared(orders, bohs, rank=None):
+    if not isinstance(orders, list):
+        orders = list(orders)
+
+    first = bohs[0]
+    differ = set()
+    for boh in bohs[1:]:
+        for sku in first.keys() | boh.keys():
+            if first.get(sku, _MISSING) != boh.get(sku, _MISSING):
+                differ.add(sku)
+
+    ready_prefix = []
+    retry_prefix = []
+    draw = {}  # sku: qty committed by the shared prefix
+    start = len(orders)
+    with phase('shared_prefix'):
+        for i, order in enumerate(orders):
+            if not differ.isdisjoint(order.items):
+                start = i
+                break
+
+            if order.commit(first, False):
+                ready_prefix.append(order)
+                for sku, qty in order.items.items():
+                    draw[sku] = draw.get(sku, 0) + qty
+
+            else:
+                retry_prefix.append(order)
+
+    results = []
+    for level, boh in enumerate(bohs):
+        with phase(f'level_{LEVELS[level]}'):
+            with phase('ready_replen'):
+                if level:
+                    for sku, qty in draw.items():
+                        boh[sku] -= qty
+
+                ready_orders = list(ready_prefix)
+                retry_orders = list(retry_prefix)
+                for i in range(start, len(orders)):
+                    order = orders[i]
+                    if order.commit(boh, False):
+                        ready_orders.append(order)
+
+                    else:
+                        retry_orders.append(order)
+
+                replen_orders, slot_orders, sku_hist = check_replen(retry_orders, boh)
+
+            with phase('slotting'):
+                results.append((ready_orders, replen_orders, check_slots(slot_orders, sku_hist, boh, rank)))
+
+    return results
+
+
+# returns: per order, a bitmask of the levels at which all its skus are slotted
+def slotted_levels(orders, bohs):
+    sku_levels = {}  # sku: bitmask of levels
+    for level, boh in enumerate(bohs):
+        for sku in boh:
+            sku_levels[sku] = sku_levels.get(sku, 0) | 1 << level
+
+    all_levels = (1 << len(bohs)) - 1
+    masks = bytearray()
+    for order in orders:
+        mask = all_levels
+        for sku in order.items:
+            mask &= sku_levels.get(sku, 0)
+        masks.append(mask)
+
+    return masks
+
+
+# returns: per order, 1 if the level's bit is set in its slotted_levels mask
+def level_mask(masks, level):
+    return masks.translate(bytes(m >> level & 1 for m in range(256)))
+
+
+class BohMatrix():
+    # boh for all levels: a row of qtys per sku plus a mask of the levels it is slotted at
+    def __init__(self, bohs):
+        self.levels = len(bohs)
+        self.index = {}  # sku: row
+        slotted = []
+        for level, boh in enumerate(bohs):
+            for sku in boh:
+                row = self.index.setdefault(sku, len(slotted))
+                if row == len(slotted):
+                    slotted.append(0)
+                slotted[row] |= 1 << level
+        self.slotted = array.array('Q', slotted)
+
+        self.qty = array.array('q', [0]) * (len(slotted) * self.levels)
+        for level, boh in enumerate(bohs):
+            for sku, qty in boh.items():
+                self.qty[self.index[sku] * self.levels + level] = qty
+
+    def write_back(self, bohs):
+        for level, boh in enumerate(bohs):
+            for sku in boh:
+                boh[sku] = self.qty[self.index[sku] * self.levels + level]
+
+
+# same as check_orders for each boh, but with one traversal of the orders;
+# each order is committed against all levels at once using a per-level mask
+def check_orders_levels(orders, bohs, rank=None):
+    with phase('ready_replen'):
+        ready_orders, replen_orders, slot_orders, sku_hists = check_ready_replen_levels(orders, bohs)
+
+    results = []
+    for level, boh in enumerate(bohs):
+        with phase(f'level_{LEVELS[level]}'), phase('slotting'):
+            slot_results = check_slots(slot_orders[level], sku_hists[level], boh, rank)
+        results.append((ready_orders[level], replen_orders[level], slot_results))
+
+    return results
+
+
+# returns: per boh (up to 64 of them): ready orders, replen orders, slot orders, missing sku counts
+def check_ready_replen_levels(orders, bohs):
+    matrix = BohMatrix(bohs)
+    levels = matrix.levels
+    index = matrix.index
+    slotted = matrix.slotted
+    avail = matrix.qty
+    all_levels = (1 << levels) - 1
+
+    ready_orders = [[] for _ in bohs]
+    replen_orders = [[] for _ in bohs]
+    slot_orders = [[] for _ in bohs]
+    sku_hists = [{} for _ in bohs]  # sku: count
+
+    # replen only needs the skus to be slotted, so its draw on boh is kept
+    # apart until every order has had its ready-to-ship check
+    replen_draw = array.array('q', [0]) * len(avail)
+
+    for order in orders:
+        lines = []
+        present = all_levels
+        for sku, qty in order.items.items():
+            row = index.get(sku)
+            if row is None:
+                present = 0
+            else:
+                present &= slotted[row]
+                row *= levels
+            lines.append((sku, row, qty))
+
+        ready = present
+        for sku, row, qty in lines:
+            if not ready:
+                break
+            for level in range(levels):
+                if ready >> level & 1 and avail[row + level] < qty:
+                    ready &= ~(1 << level)
+
+        for level in range(levels):
+            bit = 1 << level
+            if ready & bit:
+                for sku, row, qty in lines:
+                    avail[row + level] -= qty
+                ready_orders[level].append(order)
+
+            elif present & bit:
+                for sku, row, qty in lines:
+                    replen_draw[row + level] += qty
+                replen_orders[level].append(order)
+
+            else:
+                slot_orders[level].append(order)
+
+                # tally the missing skus (candidates for slotting)
+                sku_hist = sku_hists[level]
+                for sku, row, qty in lines:
+                    if row is None or not slotted[row // levels] & bit:
+                        sku_hist[sku] = sku_hist.get(sku, 0) + qty
+
+    for i, draw in enumerate(replen_draw):
+        avail[i] -= draw
+    matrix.write_back(bohs)
+
+    return ready_orders, replen_orders, slot_orders, sku_hists
+
+
+# returns: {scenario: {level or None for all levels: {sku: qty, or None to unslot it}}}
+def load_scenarios(fname):
+    scenarios = {}
+    with open_text(fname) as f:
+        reader = csv.reader(f)
+
+        # skip headers: SCENARIO,LEVEL,PRTNUM,QTY
+        headers = next(reader)
+
+        for row in reader:
+            level = int(row[1]) if row[1] else None
+            if level is not None and level not in LEVELS:
+                raise ValueError(f'{fname}:{reader.line_num}: scenario {row[0]!r} has level {level}, not one of {LEVELS}')
+            qty = int(row[3]) if row[3] else None
+            scenarios.setdefault(row[0], {}).setdefault(level, {})[row[2]] = qty
+
+    return scenarios
+
+
+SCENARIO_BATCH = 64
+
+
+# returns: (scenario, level, ready, replen, slot orders, missing skus) for the
+# unchanged boh ('baseline') and every scenario, at every level; the columns
+# are checked SCENARIO_BATCH at a time in one pass over the orders each
+def evaluate_scenarios(orders, bohs, scenarios):
+    columns = []  # (scenario, level, boh)
+    for name, deltas in {'baseline': {}, **scenarios}.items():
+        for level, base in zip(LEVELS, bohs):
+            boh = copy_boh(base)
+            for target in (None, level):
+                for sku, qty in deltas.get(target, {}).items():
+                    if qty is None:
+                        boh.pop(sku, None)
+                    else:
+                        boh[sku] = qty
+            columns.append((name, level, boh))
+
+    rows = []
+    for start in range(0, len(columns), SCENARIO_BATCH):
+        batch = columns[start:start + SCENARIO_BATCH]
+        ready_orders, replen_orders, slot_orders, sku_hists = check_ready_replen_levels(orders, [x[2] for x in batch])
+        for i, (name, level, boh) in enumerate(batch):
+            rows.append((name, level, len(ready_orders[i]), len(replen_orders[i]), len(slot_orders[i]), len(sku_hists[i])))
+
+    return rows
+
+
+# (orders, bohs) inherited by forked workers, so orders are never pickled
+_fork_state = None
+
+
+def check_level(level):
+    return worker_profile(lambda: run_level(level))
+
+
+def run_level(level):
+    orders, bohs, rank = _fork_state
+    boh = bohs[level]
+    with phase(f'level_{LEVELS[level]}'):
+        ready_orders, replen_orders, slot_results = check_orders(orders, boh, rank=rank)
+
+    # send back positions in the order list rather than the orders themselves
+    positions = {id(order): i for i, order in enumerate(orders)}
+    ready = [positions[id(order)] for order in ready_orders]
+    replen = [positions[id(order)] for order in replen_orders]
+    if not slot_results:
+        return ready, replen, boh, None
+
+    skus, addn_orders, trial_boh = slot_results[-1]
+    history = trial_boh.history
+    slots = (
+        [positions[id(order)] for order in addn_orders.orders],
+        addn_orders.unlocks,
+        skus.skus,
+        history.changes,
+        history.added,
+        history.added_steps,
+    )
+    return ready, replen, boh, slots
+
+
+# same as check_orders for each boh, with the levels run in a pool of forked workers
+def check_orders_parallel(orders, bohs, jobs, rank=None):
+    global _fork_state
+
+    if not isinstance(orders, list):
+        orders = list(orders)
+
+    _fork_state = (orders, bohs, rank)
+    try:
+        ctx = multiprocessing.get_context('fork')
+        with ctx.Pool(min(jobs, len(bohs))) as pool:
+            level_results = []
+            for result, counters, phases in pool.map(check_level, range(len(bohs))):
+                merge_profile(counters, phases)
+                level_results.append(result)
+
+    finally:
+        _fork_state = None
+
+    results = []
+    for boh, (ready, replen, post_boh, slots) in zip(bohs, level_results):
+        boh.update(post_boh)
+        slot_results = []
+        if slots:
+            slot_pos, unlocks, skus, changes, added, added_steps = slots
+            slot_orders = [orders[i] for i in slot_pos]
+            history = BohHistory(boh)
+            history.changes = changes
+            history.added = added
+            history.added_steps = added_steps
+
+            counts = [0] * len(skus)
+            for step in unlocks:
+                counts[step] += 1
+
+            addn_count = 0
+            for i in range(len(skus)):
+                addn_count += counts[i]
+                addn_orders = SlotOrders(slot_orders, unlocks, i + 1, addn_count)
+                slot_results.append((SlotSkus(skus, i + 1), addn_orders, BohOverlay(history, i)))
+
+        results.append(([orders[i] for i in ready], [orders[i] for i in replen], slot_results))
+
+    return results
+
+
+# returns: lists of order positions, one per group of orders linked by shared skus
+def order_components(orders):
+    parent = {}  # sku: sku
+
+    def find(sku):
+        root = sku
+        while parent[root] != root:
+            root = parent[root]
+        while parent[sku] != root:
+            parent[sku], sku = root, parent[sku]
+        return root
+
+    for order in orders:
+        first = None
+        for sku in order.items:
+            parent.setdefault(sku, sku)
+            if first is None:
+                first = find(sku)
+            else:
+                root = find(sku)
+                if root != first:
+                    parent[root] = first
+
+    components = {}  # root sku: [order position, ...]
+    singles = []  # orders with no lines
+    for i, order in enumerate(orders):
+        sku = next(iter(order.items), None)
+        if sku is None:
+            singles.append([i])
+        else:
+            components.setdefault(find(sku), []).append(i)
+
+    return list(components.values()) + singles
+
+
+# returns: up to `count` sorted lists of order positions, balanced by order count
+def shard_orders(orders, count):
+    shards = [[] for _ in range(count)]
+    loads = [(0, i) for i in range(count)]
+    for component in sorted(order_components(orders), key=len, reverse=True):
+        load, i = heapq.heappop(loads)
+        shards[i].extend(component)
+        heapq.heappush(loads, (load + len(component), i))
+
+    return [sorted(shard) for shard in shards if shard]
+
+
+def check_shard(task):
+    return worker_profile(lambda: run_shard(*task))
+
+
+def run_shard(level, shard):
+    orders, bohs, shards = _fork_state
+    boh = bohs[level]
+    orders = [orders[i] for i in shards[shard]]
+
+    # orders in a shard only ever touch their own skus
+    shard_boh = {}
+    for order in orders:
+        for sku in order.items:
+            if sku in boh:
+                shard_boh[sku] = boh[sku]
+
+    positions = {id(order): i for i, order in zip(shards[shard], orders)}
+    with phase(f'level_{LEVELS[level]}'), phase(f'shard_{shard}'), phase('ready_replen'):
+        ready_orders, replen_orders, slot_orders, sku_hist = check_ready_replen(orders, shard_boh)
+    return (
+        [positions[id(order)] for order in ready_orders],
+        [positions[id(order)] for order in replen_orders],
+        [positions[id(order)] for order in slot_orders],
+        shard_boh,
+    )
+
+
+# same as check_orders for each boh, with the ready and replen passes run per
+# shard of sku-disjoint orders in a pool of forked workers
+def check_orders_sharded(orders, bohs, jobs, rank=None):
+    global _fork_state
+
+    if not isinstance(orders, list):
+        orders = list(orders)
+    shards = shard_orders(orders, jobs)
+
+    _fork_state = (orders, bohs, shards)
+    try:
+        ctx = multiprocessing.get_context('fork')
+        with ctx.Pool(jobs) as pool:
+            tasks = [(level, shard) for level in range(len(bohs)) for shard in range(len(shards))]
+            shard_results = []
+            for result, counters, phases in pool.map(check_shard, tasks):
+                merge_profile(counters, phases)
+                shard_results.append(result)
+
+    finally:
+        _fork_state = None
+
+    results = []
+    for level, boh in enumerate(bohs):
+        with phase(f'level_{LEVELS[level]}'), phase('slotting'):
+            level_results = shard_results[level * len(shards):(level + 1) * len(shards)]
+            ready = heapq.merge(*[x[0] for x in level_results])
+            replen = heapq.merge(*[x[1] for x in level_results])
+            slot = heapq.merge(*[x[2] for x in level_results])
+            for x in level_results:
+                boh.update(x[3])
+
+            # the slot ranking spans shards, so tally missing skus in global order
+            slot_orders = [orders[i] for i in slot]
+            sku_hist = {}  # sku: count
+            for order in slot_orders:
+                for sku, qty in order.items.items():
+                    if sku not in boh:
+                        sku_hist[sku] = sku_hist.get(sku, 0) + qty
+
+            ready_orders = [orders[i] for i in ready]
+            replen_orders = [orders[i] for i in replen]
+            results.append((ready_orders, replen_orders, check_slots(slot_orders, sku_hist, boh, rank)))
+
+    return results
+
+
+# returns: dict of sku: positions of the orders that contain it, ascending
+def sku_index(orders):
+    index = {}
+    for i, order in enumerate(orders):
+        for sku in order.items:
+            index.setdefault(sku, []).append(i)
+
+    return index
+
+
+class Allocation():
+    # the greedy ready pass for one level, kept so that a boh change only
+    # re-runs it from the first order (in ship_id order) with a changed sku
+    # ready, ready_boh: results of an earlier ready pass over boh, if any
+    def __init__(self, orders, index, boh, ready=None, ready_boh=None):
+        self.orders = orders
+        self.index = index
+        self.boh = copy_boh(boh)  # boh before the ready pass
+        self.start = 0  # first order re-checked by the last update
+        if ready is None:
+            self.ready = bytearray(len(orders))
+            self.ready_boh = copy_boh(boh)  # boh after the ready pass
+            self.ready_pass()
+
+        else:
+            self.ready = bytearray(ready)
+            self.ready_boh = ready_boh
+
+    def ready_pass(self):
+        boh = self.ready_boh
+        ready = self.ready
+        for i in range(self.start, len(self.orders)):
+            ready[i] = self.orders[i].commit(boh, False)
+
+    # returns: position of the first order re-checked
+    def update(self, boh):
+        changed = [sku for sku in self.boh.keys() | boh.keys() if self.boh.get(sku, _MISSING) != boh.get(sku, _MISSING)]
+        start = min((self.index[sku][0] for sku in changed if sku in self.index), default=len(self.orders))
+        self.rewind(start)
+
+        # no order before start has a changed sku, so those take their new qty as is
+        ready_boh = self.ready_boh
+        for sku in changed:
+            if sku in boh:
+                ready_boh[sku] = boh[sku]
+            else:
+                ready_boh.pop(sku, None)
+
+        self.boh = copy_boh(boh)
+        self.ready_boh = {sku: ready_boh[sku] for sku in boh}
+        self.start = start
+        self.ready_pass()
+        return start
+
+    # orders: the new order list, the same as the current one before start
+    def reorder(self, orders, index, start):
+        self.rewind(start)
+        self.orders = orders
+        self.index = index
+        self.ready = self.ready[:start] + bytearray(len(orders) - start)
+        self.start = start
+        self.ready_pass()
+
+    # take back what the orders from start onward drew in the ready pass
+    def rewind(self, start):
+        ready_boh = self.ready_boh
+        for i in range(start, len(self.orders)):
+            if self.ready[i]:
+                for sku, qty in self.orders[i].items.items():
+                    ready_boh[sku] += qty
+
+    # same as check_orders(orders, boh, rank=rank), where boh matches self.boh
+    def results(self, boh, rank=None):
+        with phase('replen'):
+            boh.update(self.ready_boh)
+
+            ready_orders = []
+            retry_orders = []
+            for i, order in enumerate(self.orders):
+                if self.ready[i]:
+                    ready_orders.append(order)
+
+                else:
+                    retry_orders.append(order)
+
+            replen_orders, slot_orders, sku_hist = check_replen(retry_orders, boh)
+
+        with phase('slotting'):
+            return ready_orders, replen_orders, check_slots(slot_orders, sku_hist, boh, rank)
+
+
+# returns: (path, size, mtime) identifying the current contents of fname
+def source_key(fname):
+    return (os.path.abspath(fname),) + input_stat(fname)
+
+
+class WaveState():
+    # allocations for every level of one wave_set, persisted between runs
+    # levels: (boh, ready, ready_boh) per level from an earlier run, if any
+    def __init__(self, source, orders, bohs, levels=None):
+        self.source = source
+        self.orders = list(orders)
+        self.index = sku_index(self.orders)
+        if levels is None:
+            self.levels = []
+            for level, boh in zip(LEVELS, bohs):
+                with phase(f'level_{level}'), phase('ready'):
+                    self.levels.append(Allocation(self.orders, self.index, boh))
+
+        else:
+            self.levels = [Allocation(self.orders, self.index, *level) for level in levels]
+
+    def update(self, bohs):
+        starts = []
+        for level, allocation, boh in zip(LEVELS, self.levels, bohs):
+            with phase(f'level_{level}'), phase('ready'):
+                starts.append(allocation.update(boh))
+        return starts
+
+    # added: Order to add, replacing any with the same ship_id; removed: ship ids
+    # returns: position of the first order re-checked
+    def update_orders(self, added, removed):
+        ship_id = lambda order: order.ship_id
+        replaced = set(removed) | {order.ship_id for order in added}
+        kept = [order for order in self.orders if order.ship_id not in replaced]
+        orders = list(heapq.merge(kept, sorted(added, key=ship_id), key=ship_id))
+
+        start = min(len(self.orders), len(orders))
+        for i, (old, new) in enumerate(zip(self.orders, orders)):
+            if old is not new:
+                start = i
+                break
+
+        self.orders = orders
+        self.index = sku_index(orders)
+        for allocation in self.levels:
+            allocation.reorder(orders, self.index, start)
+        return start
+
+    def results(self, bohs, rank=None):
+        order_stats = []
+        for level, allocation, boh in zip(LEVELS, self.levels, bohs):
+            with phase(f'level_{level}'):
+                order_stats.append(allocation.results(boh, rank))
+        return order_stats
+
+
+# returns: WaveState saved for the current contents of wave_set, or None
+def load_state(fname, wave_set):
+    try:
+        with open(fname, 'rb') as f:
+            data = pickle.load(f)
+    except FileNotFoundError:
+        return None
+
+    if data['source'] != source_key(wave_set):
+        return None
+
+    orders = []
+    for ship_id, items in data['orders']:
+        order = Order(ship_id)
+        order.items = items
+        orders.append(order)
+    return WaveState(data['source'], orders, None, data['levels'])
+
+
+# state is saved as plain data, so it loads whether wave.py ran as a script or not
+def save_state(fname, state):
+    data = {
+        'source': state.source,
+        'orders': [(order.ship_id, order.items) for order in state.orders],
+        'levels': [(level.boh, bytes(level.ready), level.ready_boh) for level in state.levels],
+    }
+    tmp = f'{fname}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, fname)
+
+
+# returns: json-ready summary of check_orders results, keyed by level
+def summarize(order_stats, detail=False):
+    summary = {}
+    for level, (ready_orders, replen_orders, slot_results) in zip(LEVELS, order_stats):
+        result = {
+            'ready': len(ready_orders),
+            'replen': len(replen_orders),
+            'missing_skus': len(slot_results),
+            'slots': [len(slot[1]) for slot in slot_results],
+        }
+
+        if detail:
+            result['ready_sids'] = [order.ship_id for order in ready_orders]
+            result['replen_sids'] = [order.ship_id for order in replen_orders]
+            result['slot_skus'] = []
+            result['slot_sids'] = []  # per slot step: ship ids it adds
+            if slot_results:
+                skus, addn_orders = slot_results[-1][:2]
+                result['slot_skus'] = list(skus)
+                result['slot_sids'] = [[] for _ in skus]
+                for order, step in zip(addn_orders.orders, addn_orders.unlocks):
+                    result['slot_sids'][step].append(order.ship_id)
+
+        summary[str(level)] = result
+
+    return summary
+
+
+class WaveService():
+    # warm orders, BOH levels and allocations for the wave planning server,
+    # with each level's results kept until a change to that level
+    def __init__(self, state, bohs):
+        self.state = state
+        self.bohs = bohs  # level boh dicts, as loaded (before any check)
+        self.cache = [{} for _ in bohs]  # per level: {rank: check_orders results}
+
+    def results(self, rank=None, detail=False):
+        order_stats = []
+        for allocation, boh, cached in zip(self.state.levels, self.bohs, self.cache):
+            if rank not in cached:
+                cached[rank] = allocation.results(copy_boh(boh), rank)
+            order_stats.append(cached[rank])
+
+        return summarize(order_stats, detail)
+
+    # deltas: {level: {sku: qty, or None to unslot it}}
+    def update_boh(self, deltas):
+        # apply to copies first, so a bad delta leaves the warm state as it was
+        bohs = list(self.bohs)
+        changed = set()  # level positions with a changed qty
+        for level, delta in deltas.items():
+            i = LEVELS.index(int(level))
+            if bohs[i] is self.bohs[i]:
+                bohs[i] = copy_boh(bohs[i])
+            boh = bohs[i]
+            for sku, qty in delta.items():
+                if qty is None:
+                    boh.pop(sku, None)
+                else:
+                    boh[sku] = int(qty)
+
+            if any(self.bohs[i].get(sku, _MISSING) != boh.get(sku, _MISSING) for sku in delta):
+                changed.add(i)
+
+        self.bohs = bohs
+        for i in changed:
+            self.cache[i].clear()
+        return self.state.update(bohs)
+
+    # add: {ship_id: {sku: qty}}, replacing any existing order; remove: [ship_id]
+    def update_orders(self, add, remove):
+        if not isinstance(remove, list):
+            raise TypeError('remove must be a list of ship ids')
+
+        added = []
+        for ship_id, items in add.items():
+            order = Order(ship_id)
+            for sku, qty in items.items():
+                order.add_item(sku, int(qty))
+            added.append(order)
+
+        count = len(self.state.orders)
+        start = self.state.update_orders(added, remove)
+        if start < count or len(self.state.orders) != count:
+            for cached in self.cache:
+                cached.clear()
+        return start
+
+
+class WaveHandler(http.server.BaseHTTPRequestHandler):
+    # GET /results[?rank=coverage&detail=1]
+    # POST /boh {"1": {"A": 5, "B": null}, ...}
+    # POST /orders {"add": {"S9": {"A": 1}}, "remove": ["S1"]}
+    # every request answers with the (updated) results
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path != '/results':
+            return self.send_error(404)
+        self.respond(url, None)
+
+    def do_POST(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path not in ('/boh', '/orders'):
+            return self.send_error(404)
+
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if url.path == '/boh':
+                starts = self.server.service.update_boh(body)
+            else:
+                start = self.server.service.update_orders(body.get('add', {}), body.get('remove', []))
+                starts = [start] * len(LEVELS)
+
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return self.send_error(400, str(e))
+
+        self.respond(url, dict(zip(map(str, LEVELS), starts)))
+
+    def respond(self, url, starts):
+        query = urllib.parse.parse_qs(url.query)
+        rank = query.get('rank', ['count'])[0]
+        if rank not in SLOT_RANKINGS:
+            return self.send_error(400, f'unknown rank: {rank}')
+
+        results = self.server.service.results(SLOT_RANKINGS[rank], query.get('detail', ['0'])[0] == '1')
+        body = json.dumps({'rechecked_from': starts, 'levels': results} if starts else {'levels': results}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # unix socket peers have no (host, port)
+        return self.client_address[0] if self.client_address else 'unix'
+
+
+class UnixHTTPServer(socketserver.UnixStreamServer):
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, None
+
+
+# address: host:port for tcp, otherwise the path of a unix socket
+def serve(address, service):
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit():
+        server = http.server.HTTPServer((host or '127.0.0.1', int(port)), WaveHandler)
+
+    else:
+        # only ever replace a stale socket, never a file at a mistyped path
+        if os.path.lexists(address):
+            if not stat.S_ISSOCK(os.lstat(address).st_mode):
+                raise FileExistsError(errno.EEXIST, 'not a socket, will not replace it', address)
+            os.remove(address)
+        server = UnixHTTPServer(address, WaveHandler)
+
+    server.service = service
+    print(f'serving on {address}')
+    try:
+        server.serve_forever()
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        server.server_close()
+
+
+REPORT_BATCH_ROWS = 10000
+REPORT_QUEUE_CHUNKS = 16
+REPORT_PUT_TIMEOUT = 0.1
+
+
+class ReportQueue():
+    # bounded queue of csv text drained to disk by one background thread, so
+    # formatting rows overlaps with file i/o while memory stays capped at
+    # REPORT_QUEUE_CHUNKS batches
+    def __init__(self, size=REPORT_QUEUE_CHUNKS):
+        self.queue = queue.Queue(size)
+        self.error = None
+        self.thread = threading.Thread(target=self.drain, daemon=True)
+        self.thread.start()
+
+    def drain(self):
+        f = None
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+
+            op, arg = item
+            if self.error:
+                continue
+            try:
+                if op == 'open':
+                    f = open_text(arg, 'w')
+
+                elif op == 'write':
+                    f.write(arg)
+
+                else:
+                    f.close()
+                    f = None
+                    COUNTERS['files_written'] += 1
+                    COUNTERS['bytes_written'] += os.path.getsize(arg)
+
+            except BaseException as e:
+                # kept for put and close to raise; later items are dropped
+                self.error = e
+                if f:
+                    try:
+                        f.close()
+                    except BaseException:
+                        pass
+                    f = None
+
+    # returns: whether item was queued before the drain thread went away
+    def offer(self, item):
+        while self.thread.is_alive():
+            try:
+                self.queue.put(item, timeout=REPORT_PUT_TIMEOUT)
+                return True
+
+            except queue.Full:
+                pass
+
+        return False
+
+    def put(self, op, arg):
+        queued = not self.error and self.offer((op, arg))
+        if self.error:
+            raise self.error
+        if not queued:
+            raise RuntimeError('report writer thread exited')
+
+    def close(self):
+        self.offer(None)
+        self.thread.join()
+        if self.error:
+            raise self.error
+
+
+class ReportWriter():
+    # csv writer that formats rows REPORT_BATCH_ROWS at a time and hands the text to write
+    def __init__(self, write):
+        self.write = write
+        self.rows = []
+
+    def writerow(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= REPORT_BATCH_ROWS:
+            self.flush()
+
+    def writerows(self, rows):
+        rows = iter(rows)
+        while True:
+            self.rows.extend(itertools.islice(rows, REPORT_BATCH_ROWS - len(self.rows)))
+            if len(self.rows) < REPORT_BATCH_ROWS:
+                break
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            buf = io.StringIO()
+            csv.writer(buf).writerows(self.rows)
+            COUNTERS['rows_written'] += len(self.rows)
+            self.rows = []
+            self.write(buf.getvalue())
+
+
+# yields a csv writer for path, with the header row already written
+# sink: ReportQueue to write through
+# compress: CODECS name to compress with (adding its suffix to path), or None
+@contextlib.contextmanager
+def report_csv(path, header, sink, compress=None):
+    if compress:
+        path += CODECS[compress][1]
+
+    sink.put('open', path)
+    try:
+        writer = ReportWriter(lambda text: sink.put('write', text))
+        writer.writerow(header)
+        yield writer
+        writer.flush()
+
+    finally:
+        sink.put('close', path)
+
+
+def order_rows(orders):
+    return ([order.ship_id, sku, 'ECOM', qty] for order in orders for sku, qty in order.items.items())
+
+
+def sid_rows(orders):
+    return ([order.ship_id] for order in orders)
+
+
+# writes the ready, replen and slot CSVs for every level under report_dir
+# mode: 'full' writes every slot_N as the whole wave, 'delta' only what each
+# slot step adds (see write_slot_deltas)
+# jobs: with more than 1, levels are written in parallel by forked workers
+# compress: CODECS name to stream every file through, or None
+def write_reports(report_dir, order_stats, bohs, mode='full', jobs=1, compress=None):
+    global _fork_state
+
+    if jobs > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        _fork_state = (report_dir, order_stats, bohs, mode, compress)
+        try:
+            ctx = multiprocessing.get_context('fork')
+            with ctx.Pool(min(jobs, len(bohs))) as pool:
+                for counters in pool.map(write_level_task, range(len(bohs))):
+                    COUNTERS.update(counters)
 
-        # copy boh for each iteration to ensure same starting point
-        trial_boh = dict(boh)
-        for s in slot_candidates:
-            trial_boh[s] = 0
+        finally:
+            _fork_state = None
 
-        addn_orders = []
-        for order in slot_orders:
-            if order.commit(trial_boh, True):
-                addn_orders.append(order)
+    else:
+        for i, level in enumerate(LEVELS):
+            write_level_report(report_dir, level, order_stats[i], bohs[i], mode, compress)
 
-        slot_results.append((list(slot_candidates), addn_orders, trial_boh))
 
-    return ready_orders, replen_orders, slot_results
+# returns: the COUNTERS for writing this level
+def write_level_task(i):
+    report_dir, order_stats, bohs, mode, compress = _fork_state
+    COUNTERS.clear()
+    write_level_report(report_dir, LEVELS[i], order_stats[i], bohs[i], mode, compress)
+    return dict(COUNTERS)
+
+
+def write_level_report(report_dir, level, stats, boh, mode='full', compress=None):
+    base_dir = os.path.join(report_dir, f'level_{level}')
+    os.makedirs(base_dir)
+
+    sink = ReportQueue()
+    try:
+        wave_set = list(stats[0])
+
+        if wave_set:
+            with report_csv(os.path.join(base_dir, f'{level}_ready_orders.csv'), ['SHIP_ID', 'PRTNUM', 'WAVE_SET', 'ORDQTY'], sink, compress) as writer:
+                writer.writerows(order_rows(wave_set))
+
+            with report_csv(os.path.join(base_dir, f'{level}_ready_sids.csv'), ['SHIP_ID'], sink, compress) as writer:
+                writer.writerows(sid_rows(wave_set))
+
+
+        replen_orders = stats[1]
+        wave_set.extend(replen_orders)
+        if wave_set:
+            with report_csv(os.path.join(base_dir, f'{level}_ready_replen_orders.csv'), ['SHIP_ID', 'PRTNUM', 'WAVE_SET', 'ORDQTY'], sink, compress) as writer:
+                writer.writerows(order_rows(wave_set))
+
+            with report_csv(os.path.join(base_dir, f'{level}_ready_replen_sids.csv'), ['SHIP_ID'], sink, compress) as writer:
+                writer.writerows(sid_rows(wave_set))
+
+        if replen_orders or (mode == 'delta' and stats[2]):
+            with report_csv(os.path.join(base_dir, f'boh.csv'), ['PRTNUM', 'Qty'], sink, compress) as writer:
+                writer.writerows(boh.items())
+
+        slots = stats[2]
+        if slots and mode == 'delta':
+            write_slot_deltas(base_dir, level, slots, len(wave_set), sink, compress)
+
+        elif slots:
+            for slot in slots:
+                slot_wave_set = list(wave_set)
+                slot_wave_set.extend(slot[1])
+                skus = slot[0]
+                slot_count = len(skus)
+                boh = slot[2]
+                slot_dir = os.path.join(base_dir, f'slot_{slot_count}')
+
+                os.mkdir(slot_dir)
+                with report_csv(os.path.join(slot_dir, f'{level}_slot_{slot_count}_orders.csv'), ['SHIP_ID', 'PRTNUM', 'WAVE_SET', 'ORDQTY'], sink, compress) as writer:
+                    writer.writerows(order_rows(slot_wave_set))
+
+                with report_csv(os.path.join(slot_dir, f'{level}_slot_{slot_count}_sids.csv'), ['SHIP_ID'], sink, compress) as writer:
+                    writer.writerows(sid_rows(slot_wave_set))
+
+                with report_csv(os.path.join(slot_dir, 'skus.csv'), ['PRTNUM'], sink, compress) as writer:
+                    writer.writerows([sku] for sku in skus)
+
+                with report_csv(os.path.join(slot_dir, 'boh.csv'), ['PRTNUM', 'Qty'], sink, compress) as writer:
+                    writer.writerows(boh.items())
+
+    finally:
+        sink.close()
+
+
+# writes, per slot_N, only the orders, sku and boh entries that step adds,
+# plus a manifest.json describing how to rebuild the full slot_N views
+def write_slot_deltas(base_dir, level, slots, base_count, sink, compress=None):
+    skus, addn_orders, trial_boh = slots[-1]
+
+    added = [[] for _ in skus]  # per slot step: orders it unlocks
+    for order, step in zip(addn_orders.orders, addn_orders.unlocks):
+        added[step].append(order)
+
+    changed = [[] for _ in skus]  # per slot step: (sku, qty) it sets
+    for sku, (steps, qtys) in trial_boh.history.changes.items():
+        for step, qty in zip(steps, qtys):
+            changed[step].append((sku, qty))
+
+    suffix = CODECS[compress][1] if compress else ''
+    manifest = {
+        'mode': 'delta',
+        'level': level,
+        'compress': compress,
+        'base_orders': f'{level}_ready_replen_orders.csv{suffix}' if base_count else None,
+        'base_sids': f'{level}_ready_replen_sids.csv{suffix}' if base_count else None,
+        'base_boh': f'boh.csv{suffix}',
+        'rebuild': 'slot_N orders and sids: base rows, then the slot_1..slot_N rows merged by SHIP_ID; '
+                   'skus: slot_1..slot_N skus.csv in order; '
+                   'boh: base_boh with slot_1..slot_N boh.csv rows applied in order',
+        'steps': [],
+    }
+
+    count = base_count
+    for i, sku in enumerate(skus):
+        slot_count = i + 1
+        slot_dir = os.path.join(base_dir, f'slot_{slot_count}')
+        os.mkdir(slot_dir)
+
+        with report_csv(os.path.join(slot_dir, f'{level}_slot_{slot_count}_orders.csv'), ['SHIP_ID', 'PRTNUM', 'WAVE_SET', 'ORDQTY'], sink, compress) as writer:
+            writer.writerows(order_rows(added[i]))
+
+        with report_csv(os.path.join(slot_dir, f'{level}_slot_{slot_count}_sids.csv'), ['SHIP_ID'], sink, compress) as writer:
+            writer.writerows(sid_rows(added[i]))
+
+        with report_csv(os.path.join(slot_dir, 'skus.csv'), ['PRTNUM'], sink, compress) as writer:
+            writer.writerow([sku])
+
+        with report_csv(os.path.join(slot_dir, 'boh.csv'), ['PRTNUM', 'Qty'], sink, compress) as writer:
+            writer.writerows(changed[i])
+
+        count += len(added[i])
+        manifest['steps'].append({
+            'dir': f'slot_{slot_count}',
+            'sku': sku,
+            'added_orders': len(added[i]),
+            'orders': count,
+            'boh_entries': len(changed[i]),
+        })
+
+    with open(os.path.join(base_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+REPORT_SCHEMA = '''
+CREATE TABLE order_lines (ship_id TEXT, sku TEXT, qty INTEGER);
+-- stage: ready, replen or slot; step: for slot, the slot step that unlocks the order (1-based)
+CREATE TABLE wave (level INTEGER, stage TEXT, step INTEGER, ship_id TEXT);
+CREATE TABLE slot_skus (level INTEGER, step INTEGER, sku TEXT);
+-- step 0: boh after ready and replen; step N: the entries slot step N sets
+-- (boh at slot_N: the latest row per sku with step <= N)
+CREATE TABLE boh (level INTEGER, step INTEGER, sku TEXT, qty INTEGER);
+'''
+
+REPORT_INDEXES = '''
+CREATE INDEX order_lines_ship_id ON order_lines (ship_id);
+CREATE INDEX wave_stage ON wave (level, stage, step);
+CREATE INDEX wave_ship_id ON wave (ship_id);
+CREATE INDEX slot_skus_step ON slot_skus (level, step);
+CREATE INDEX boh_sku ON boh (level, sku, step);
+'''
+
+
+# writes every level's results into one sqlite database at path, in a single
+# transaction of bulk inserts; the slot_N views are queries on step (see REPORT_SCHEMA)
+def write_report_db(path, order_stats, bohs):
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        with conn:
+            conn.executescript(REPORT_SCHEMA)
+
+            # every order lands in exactly one stage per level, so level 1 has them all
+            ready_orders, replen_orders, slots = order_stats[0]
+            orders = itertools.chain(ready_orders, replen_orders, slots[-1][1].orders if slots else [])
+            conn.executemany('INSERT INTO order_lines VALUES (?, ?, ?)', ((order.ship_id, sku, qty) for order in orders for sku, qty in order.items.items()))
+
+            for level, (ready_orders, replen_orders, slots), boh in zip(LEVELS, order_stats, bohs):
+                conn.executemany('INSERT INTO wave VALUES (?, ?, 0, ?)', ((level, 'ready', order.ship_id) for order in ready_orders))
+                conn.executemany('INSERT INTO wave VALUES (?, ?, 0, ?)', ((level, 'replen', order.ship_id) for order in replen_orders))
+                conn.executemany('INSERT INTO boh VALUES (?, 0, ?, ?)', ((level, sku, qty) for sku, qty in boh.items()))
+                if not slots:
+                    continue
+
+                skus, addn_orders, trial_boh = slots[-1]
+                conn.executemany('INSERT INTO wave VALUES (?, ?, ?, ?)', ((level, 'slot', step + 1, order.ship_id) for order, step in zip(addn_orders.orders, addn_orders.unlocks)))
+                conn.executemany('INSERT INTO slot_skus VALUES (?, ?, ?)', ((level, step + 1, sku) for step, sku in enumerate(skus)))
+                conn.executemany('INSERT INTO boh VALUES (?, ?, ?, ?)', ((level, step + 1, sku, qty) for sku, (steps, qtys) in trial_boh.history.changes.items() for step, qty in zip(steps, qtys)))
+
+            conn.executescript(REPORT_INDEXES)
+
+    finally:
+        conn.close()
+
+    COUNTERS['files_written'] += 1
+    COUNTERS['bytes_written'] += os.path.getsize(path)
 
 
 def cprint(c1, c2, c3, c4, c5):
@@ -149,21 +2325,144 @@ def safe(f, arg, alt='-'):
         return alt    
 
 
+# returns: check_orders results for every boh, using the mode picked by args
+def check_all(args, orders, bohs, state, rank):
+    if args.state:
+        if state:
+            state.update(bohs)
+
+        else:
+            state = WaveState(source_key(args.wave_set), orders, bohs)
+
+        order_stats = state.results(bohs, rank)
+        save_state(args.state, state)
+
+    elif args.vectorize:
+        order_stats = check_orders_levels(orders, bohs, rank)
+
+    elif args.shared_prefix:
+        order_stats = check_orders_shared(orders, bohs, rank)
+
+    elif args.jobs > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        if args.shard:
+            order_stats = check_orders_sharded(orders, bohs, args.jobs, rank)
+
+        else:
+            order_stats = check_orders_parallel(orders, bohs, args.jobs, rank)
+
+    else:
+        order_stats = []
+        masks = slotted_levels(orders, bohs)
+        for level, boh in enumerate(bohs):
+            with phase(f'level_{LEVELS[level]}'):
+                order_stats.append(check_orders(orders, boh, level_mask(masks, level), rank))
+
+    return order_stats
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('wave_set')
     parser.add_argument('boh')
     parser.add_argument('-r', '--report', type=str, help='generate CSVs in specified directory')
+    parser.add_argument('--report-sink', choices=['csv', 'sqlite'], default='csv', help='write reports as a directory of CSVs or as one SQLite database')
+    parser.add_argument('--report-mode', choices=['full', 'delta'], default='full', help='write each slot_N as the whole wave, or only what it adds')
+    parser.add_argument('--report-compress', choices=CODECS, help='stream every report CSV through the specified compressor')
+    parser.add_argument('--compact', action='store_true', help='load orders into a compact columnar store')
+    parser.add_argument('--profiles', action='store_true', help='share one items dict between orders with identical lines')
+    parser.add_argument('--stream', action='store_true', help='read orders in bounded-memory chunks into the compact store (implies --compact)')
+    parser.add_argument('--cache', type=str, help='cache parsed inputs in specified directory (implies --compact)')
+    parser.add_argument('--rank', choices=SLOT_RANKINGS, default='count', help='order missing SKUs by total qty or by orders unlocked')
+    parser.add_argument('--serve', type=str, help='keep state warm and serve results over HTTP on host:port or a unix socket path')
+    parser.add_argument('--scenarios', type=str, help='evaluate the what-if BOH changes in specified CSV (SCENARIO,LEVEL,PRTNUM,QTY)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='load inputs, check and write reports for BOH levels in N worker processes')
+
+    # alternative ways to check the orders; at most one applies
+    modes = parser.add_mutually_exclusive_group()
+    modes.add_argument('--state', type=str, help='keep allocation state in specified file and only re-check orders affected by BOH changes')
+    modes.add_argument('--shared-prefix', action='store_true', help='run the ready pass once for orders before the first SKU that differs between levels')
+    modes.add_argument('--vectorize', action='store_true', help='check all BOH levels in one pass over the orders')
+    modes.add_argument('--shard', action='store_true', help='with --jobs, split orders into groups with no skus in common')
+    parser.add_argument('--profile', type=str, help='save per-phase timings and counters as JSON to specified file')
+    parser.add_argument('--tracemalloc', action='store_true', help='with --profile, also record peak memory with tracemalloc')
 
     args = parser.parse_args()
 
-    bohs = load_boh(args.boh)
-    orders = load_orders(args.wave_set)
+    if args.report_compress and args.report_sink == 'sqlite':
+        parser.error('--report-compress applies to the csv report sink')
 
-    order_stats = []
-    for boh in bohs:
-        order_stats.append(check_orders(orders, boh))
+    if args.jobs < 1:
+        parser.error('-j/--jobs must be 1 or more')
 
+    if args.shard and args.jobs < 2:
+        parser.error('--shard needs -j/--jobs of 2 or more')
+
+    for flag in ('state', 'shared_prefix', 'vectorize'):
+        if args.jobs > 1 and getattr(args, flag):
+            parser.error(f'-j/--jobs checks levels in parallel and cannot be combined with --{flag.replace("_", "-")}')
+
+    global PROFILE
+    if args.profile:
+        PROFILE = Profile(args.tracemalloc)
+        PROFILE.count_commits()
+
+    try:
+        run_wave(args)
+
+    finally:
+        if PROFILE:
+            PROFILE.save(args.profile)
+            PROFILE = None
+
+
+def run_wave(args):
+    with phase('load_boh'):
+        if args.cache:
+            bohs = load_boh_cached(args.boh, args.cache, args.jobs)
+
+        else:
+            bohs = load_boh(args.boh, args.jobs)
+
+    with phase('load_orders'):
+        state = load_state(args.state, args.wave_set) if args.state else None
+        if state:
+            orders = state.orders
+
+        elif args.cache:
+            load = stream_order_store if args.stream else (lambda fname: load_order_store(fname, args.jobs))
+            orders = load_order_store_cached(args.wave_set, args.cache, load)
+
+        elif args.stream:
+            orders = stream_order_store(args.wave_set)
+
+        elif args.compact:
+            orders = load_order_store(args.wave_set, args.jobs)
+
+        else:
+            orders = load_orders(args.wave_set, args.profiles, args.jobs)
+
+        if args.profiles and not isinstance(orders, list):
+            orders = share_profiles(orders)
+
+    if args.scenarios:
+        print(f'{"Scenario": <20}{"Level": >6}{"Ready": >10}{"Replen": >10}{"Slot": >10}{"Missing": >10}')
+        for row in evaluate_scenarios(orders, bohs, load_scenarios(args.scenarios)):
+            print(f'{row[0]: <20}{row[1]: >6}{row[2]: >10}{row[3]: >10}{row[4]: >10}{row[5]: >10}')
+        return
+
+    rank = SLOT_RANKINGS[args.rank]
+    if args.serve:
+        if state:
+            state.update(bohs)
+
+        else:
+            state = WaveState(source_key(args.wave_set), orders, bohs)
+
+        serve(args.serve, WaveService(state, bohs))
+        return
+
+    with phase('check'):
+        order_stats = check_all(args, orders, bohs, state, rank)
 
     cprint('Level', 1, 3, 4, 6)
     cprint('=====', '=', '=', '=', '=')
@@ -187,89 +2486,12 @@ def main():
             sys.exit(1)
 
         else:
-            levels = [1, 3, 4, 6]
-            for i in range(4):
-                level = levels[i]
-                stats = order_stats[i]
-                boh = bohs[i]
-                base_dir = os.path.join(args.report, f'level_{level}')
-                os.makedirs(base_dir)
-
-                wave_set = list(stats[0])
-
-                if wave_set:
-                    with open(os.path.join(base_dir, f'{level}_ready_orders.csv'), 'w', newline='') as f:
-                        writer = csv.writer(f)
-                        writer.writerow(['SHIP_ID', 'PRTNUM', 'WAVE_SET', 'ORDQTY'])
-                        for order in wave_set:
-                            for sku, qty in order.items.items():
-                                writer.writerow([order.ship_id, sku, 'ECOM', qty])
-
-                    with open(os.path.join(base_dir, f'{level}_ready_sids.csv'), 'w', newline='') as f:
-                        writer = csv.writer(f)
-                        writer.writerow(['SHIP_ID'])
-                        for order in wave_set:
-                            writer.writerow([order.ship_id])
-
-
-                replen_orders = stats[1]
-                wave_set.extend(replen_orders)
-                if wave_set:
-                    with open(os.path.join(base_dir, f'{level}_ready_replen_orders.csv'), 'w', newline='') as f:
-                        writer = csv.writer(f)
-                        writer.writerow(['SHIP_ID', 'PRTNUM', 'WAVE_SET', 'ORDQTY'])
-                        for order in wave_set:
-                            for sku, qty in order.items.items():
-                                writer.writerow([order.ship_id, sku, 'ECOM', qty])
-
-                    with open(os.path.join(base_dir, f'{level}_ready_replen_sids.csv'), 'w', newline='') as f:
-                        writer = csv.writer(f)
-                        writer.writerow(['SHIP_ID'])
-                        for order in wave_set:
-                            writer.writerow([order.ship_id])
-
-                if replen_orders:
-                    with open(os.path.join(base_dir, f'boh.csv'), 'w', newline='') as f:
-                        writer = csv.writer(f)
-                        writer.writerow(['PRTNUM', 'Qty'])
-                        for sku, qty in boh.items():
-                            writer.writerow([sku, qty])
-
-                slots = stats[2]
-                if slots:
-                    for slot in slots:
-                        slot_wave_set = list(wave_set)
-                        slot_wave_set.extend(slot[1])
-                        skus = slot[0]
-                        slot_count = len(skus)
-                        boh = slot[2]
-                        slot_dir = os.path.join(base_dir, f'slot_{slot_count}')
-
-                        os.mkdir(slot_dir)
-                        with open(os.path.join(slot_dir, f'{level}_slot_{slot_count}_orders.csv'), 'w', newline='') as f:
-                            writer = csv.writer(f)
-                            writer.writerow(['SHIP_ID', 'PRTNUM', 'WAVE_SET', 'ORDQTY'])
-                            for order in slot_wave_set:
-                                for sku, qty in order.items.items():
-                                    writer.writerow([order.ship_id, sku, 'ECOM', qty])
-
-                        with open(os.path.join(slot_dir, f'{level}_slot_{slot_count}_sids.csv'), 'w', newline='') as f:
-                            writer = csv.writer(f)
-                            writer.writerow(['SHIP_ID'])
-                            for order in slot_wave_set:
-                                writer.writerow([order.ship_id])
-
-                        with open(os.path.join(slot_dir, 'skus.csv'), 'w', newline='') as f:
-                            writer = csv.writer(f)
-                            writer.writerow(['PRTNUM'])
-                            for sku in skus:
-                                writer.writerow([sku])
-
-                        with open(os.path.join(slot_dir, 'boh.csv'), 'w', newline='') as f:
-                            writer = csv.writer(f)
-                            writer.writerow(['PRTNUM', 'Qty'])
-                            for sku, qty in boh.items():
-                                writer.writerow([sku, qty])
+            with phase('report'):
+                if args.report_sink == 'sqlite':
+                    write_report_db(args.report, order_stats, bohs)
+
+                else:
+                    write_reports(args.report, order_stats, bohs, args.report_mode, args.jobs, args.report_compress)
 
 
 if __name__ == "__main__":